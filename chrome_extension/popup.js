@@ -118,24 +118,6 @@ document.addEventListener("DOMContentLoaded", async () => {
             return;
         }
 
-        // Prepare data for Word Cloud (Array of comment strings)
-        const rawCommentsForWordCloud = analyzedData.map(item => item.Original_Comment);
-
-        // Prepare data for Trend Graph (Array of objects with timestamp & sentiment)
-        const sentimentData = analyzedData.map(item => ({
-            timestamp: item.timestamp,
-            sentiment: parseInt(item.sentiment)
-        }));
-
-        // Prepare data for Pie Chart (Count of each sentiment)
-        const sentimentCounts = { "1": 0, "0": 0, "-1": 0 };
-        analyzedData.forEach(item => {
-            const key = String(item.sentiment); 
-            if (sentimentCounts[key] !== undefined) {
-                sentimentCounts[key]++;
-            }
-        });
-
         // Calculate summary metrics
         const totalComments = analyzedData.length;
         const uniqueCommenters = new Set(analyzedData.map(item => item.AuthorID)).size;
@@ -175,24 +157,18 @@ document.addEventListener("DOMContentLoaded", async () => {
             <div id="chart-container"></div>
           </div>`;
 
-        // Display the pie chart
-        await fetchAndDisplayChart(sentimentCounts);
-
-        // Display the Sentiment Trend Graph
+        // Add the chart, trend graph and word cloud sections; the server renders all three from its copy of the analysis
         outputDiv.innerHTML += `
           <div class="section">
             <div class="section-title">Sentiment Trend Over Time</div>
             <div id="trend-graph-container"></div>
           </div>`;
-        await fetchAndDisplayTrendGraph(sentimentData);
-
-        // Display the Word Cloud
         outputDiv.innerHTML += `
           <div class="section">
             <div class="section-title">Comment Wordcloud</div>
             <div id="wordcloud-container"></div>
           </div>`;
-        await fetchAndDisplayWordCloud(rawCommentsForWordCloud);
+        await fetchAndDisplayCharts(videoId);
 
         // Display the top comments
         outputDiv.innerHTML += `
@@ -219,10 +195,10 @@ document.addEventListener("DOMContentLoaded", async () => {
         // But if your /api/analyze_video endpoint requires it for credit deduction, include it.
         // Based on your previous app.py, analyze_video only checked for login, not deviceId.
         const device_id = await getDeviceId();
-        const response = await fetch(`${API_URL}/api/analyze_video`, {
+        const response = await fetch(`${API_URL}/api/analyze_video/stream`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ videoId: videoId, visitorId : device_id }),
+          body: JSON.stringify({ videoId: videoId, visitorId : device_id, incremental: true }), // only classify comments added since the last run
           credentials: "include" // IMPORTANT: Sends the session cookies
         });
 
@@ -231,88 +207,63 @@ document.addEventListener("DOMContentLoaded", async () => {
             throw new Error(errorData.error || 'Server error');
         }
 
-        return await response.json(); // Returns the list of analyzed comments
+        // Read the newline-delimited JSON stream, one record per classified page of comments
+        const analyzedData = [];
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split("\n");
+          buffer = lines.pop(); // keep the incomplete last line
+          for (const line of lines) {
+            if (!line.trim()) continue;
+            const record = JSON.parse(line);
+            if (record.type === "comments") {
+              analyzedData.push(...record.comments);
+              reportstatusDisplay.innerHTML = `Analyzed ${analyzedData.length} comments...`;
+            } else if (record.type === "error") {
+              throw new Error(record.error);
+            }
+          }
+        }
+
+        return analyzedData; // Returns the list of analyzed comments
       } catch (error) {
         console.log("Error fetching analyzed data:", error);
         return null;
       }
     }
 
-    // Display the Pie chart
-    async function fetchAndDisplayChart(sentimentCounts) {
+    // Display the pie chart, trend graph and word cloud, fetched together in one request
+    async function fetchAndDisplayCharts(videoId) {
       try {
-        const response = await fetch(`${API_URL}/api/generate_chart`, {
+        const response = await fetch(`${API_URL}/api/chart_bundle`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ sentiment_counts: sentimentCounts }),
+          body: JSON.stringify({ videoId: videoId }),
           credentials: "include"
         });
         if (!response.ok) {
-          throw new Error('Failed to fetch chart image');
+          throw new Error('Failed to fetch chart images');
         }
-        const blob = await response.blob();
-        const imgURL = URL.createObjectURL(blob);
-        const img = document.createElement('img');
-        img.src = imgURL;
-        img.style.width = '100%';
-        img.style.marginTop = '20px';
-        // Append the image to the chart-container div
-        const chartContainer = document.getElementById('chart-container');
-        chartContainer.appendChild(img);
-      } catch (error) {
-        outputDiv.innerHTML += "<p>Error fetching chart image.</p>";
-      }
-    }
-
-    // Display the word cloud
-    async function fetchAndDisplayWordCloud(comments) {
-      try {
-        const response = await fetch(`${API_URL}/api/generate_wordcloud`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ comments }),
-          credentials: "include"
-        });
-        if (!response.ok) {
-          throw new Error('Failed to fetch word cloud image');
-        }
-        const blob = await response.blob();
-        const imgURL = URL.createObjectURL(blob);
-        const img = document.createElement('img');
-        img.src = imgURL;
-        img.style.width = '100%';
-        img.style.marginTop = '20px';
-        // Append the image to the wordcloud-container div
-        const wordcloudContainer = document.getElementById('wordcloud-container');
-        wordcloudContainer.appendChild(img);
-      } catch (error) {
-        outputDiv.innerHTML += "<p>Error fetching word cloud image.</p>";
-      }
-    }
-
-    // Display the sentiment trend graph
-    async function fetchAndDisplayTrendGraph(sentimentData) {
-      try {
-        const response = await fetch(`${API_URL}/api/generate_trend_graph`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ sentiment_data: sentimentData }),
-          credentials: "include"
-        });
-        if (!response.ok) {
-          throw new Error('Failed to fetch trend graph image');
+        const bundle = await response.json();
+        const containers = { chart: 'chart-container', trend_graph: 'trend-graph-container', wordcloud: 'wordcloud-container' };
+        for (const [name, containerId] of Object.entries(containers)) {
+          if (!bundle.charts[name]) {
+            outputDiv.innerHTML += `<p>Error rendering ${name.replace('_', ' ')} image.</p>`;
+            continue;
+          }
+          const img = document.createElement('img');
+          img.src = `data:${bundle.mimetype};base64,${bundle.charts[name]}`;
+          img.style.width = '100%';
+          img.style.marginTop = '20px';
+          document.getElementById(containerId).appendChild(img);
         }
-        const blob = await response.blob();
-        const imgURL = URL.createObjectURL(blob);
-        const img = document.createElement('img');
-        img.src = imgURL;
-        img.style.width = '100%';
-        img.style.marginTop = '20px';
-        // Append the image to the trend-graph-container div
-        const trendGraphContainer = document.getElementById('trend-graph-container');
-        trendGraphContainer.appendChild(img);
       } catch (error) {
-        outputDiv.innerHTML += "<p>Error fetching trend graph image.</p>";
+        outputDiv.innerHTML += "<p>Error fetching chart images.</p>";
       }
     }
   });
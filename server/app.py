@@ -1,21 +1,22 @@
 # To install the required packages: pip install -r requirements.txt
 # To run the program: python app.py
-from flask import Flask, flash, render_template, request, redirect, session, url_for, jsonify
-import os, pyotp, uuid, glob, time, atexit, hmac, hashlib, razorpay
-from authlib.integrations.flask_client import OAuth
+from flask import Flask, flash, render_template, request, redirect, session, url_for, jsonify, Response, send_file, g, stream_with_context
+import os, pyotp, uuid, glob, time, atexit, hmac, hashlib, json
 from datetime import datetime, timedelta, timezone
+from itertools import chain
+from functools import lru_cache
 from utils.alert import generate_otp, send_otp
 from flask_wtf.csrf import CSRFProtect
 from flask_session import Session
-from utils.database import Database, db
+from utils.database import Database, Admin, db
 from utils.payment import generateCode
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from dotenv import load_dotenv
+from utils.lazy import LazyModule
+from utils import metrics, profiler, sessions
 from utils import satya
 from random import *
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend before importing pyplot
 
 
 
@@ -45,20 +46,33 @@ app.config["SECRET_KEY"]=secret_key
 app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_URL}/{DATABASE_NAME}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
 app.config["SESSION_PERMANENT"]=True
-app.config["SESSION_TYPE"]='filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30) # logs users out after 30 days of inactivity
+app.config["SESSION_TYPE"]=os.getenv('SESSION_TYPE', 'sqlite') # sqlite: utils/sessions.py; anything else is a Flask-Session backend
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30) # logs users out after 30 days of inactivity (27 to 30, see SESSION_REFRESH_AFTER)
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevents JavaScript access
 app.config['SESSION_COOKIE_SECURE'] = False # True # Ensures cookies are only sent over HTTPS.
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax' # Protects against CSRF attacks
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False # sessions are saved when they change or by extend_session_if_active, not on every request
+SESSION_REFRESH_AFTER = float(os.getenv('SESSION_REFRESH_AFTER', 0.1)) # share of the session lifetime after which an unchanged session is rewritten (0 = every request)
 CORS(app, supports_credentials=True, origins=[os.getenv("DOMAIN_URL")])
 db.init_app(app)
 db_obj = Database()
 bcrypt=Bcrypt(app)
 csrf = CSRFProtect(app)
-Session(app) # to store the session data at the server side instead of client side. # Initialize session
-oauth = OAuth(app)
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-with app.app_context(): # Register the Google OAuth client within the Flask app context
+if app.config["SESSION_TYPE"] == 'sqlite':
+    sessions.init_app(app) # server side sessions in ./cache/sessions.db, swept incrementally in the background
+else:
+    Session(app) # to store the session data at the server side instead of client side. # Initialize session
+metrics.init_app(app) # request latency and SQL statement counts for /metrics
+razorpay = LazyModule('razorpay') # imported on the first payment request
+
+@lru_cache(maxsize=None)
+def get_razorpay_client():
+    return razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+
+@lru_cache(maxsize=None)
+def get_oauth(): # authlib is imported and the Google OAuth client registered on the first login
+    from authlib.integrations.flask_client import OAuth
+    oauth = OAuth(app)
     oauth.register("myApp",# Name of the OAuth client
                     client_id = os.getenv("OAUTH2_CLIENT_ID"), # Get OAuth client ID from environment variables
                     client_secret=os.getenv("OAUTH2_CLIENT_SECRET"), # Get OAuth client secret
@@ -68,6 +82,7 @@ with app.app_context(): # Register the Google OAuth client within the Flask app
                     # api_base_url='https://www.googleapis.com/oauth2/v1/',
                     client_kwargs={"scope": "openid profile email"}# Request access to basic profile information and email only
                     )
+    return oauth
 
 
 def validate_fields(*fields):
@@ -83,15 +98,32 @@ def clear_expired_sessions(path='flask_session'):
 
 @atexit.register
 def cleanup_sessions():
-    clear_expired_sessions('flask_session')
+    if app.config["SESSION_TYPE"] == 'filesystem': # the sqlite store sweeps itself
+        clear_expired_sessions('flask_session')
 
-@app.before_request # Every time the user loads any page, Flask marks the session as "modified". The expiration clock resets to another 30 days. So if they visit on day 20, they stay logged in until day 50.
+@app.before_request # Sliding expiry: once SESSION_REFRESH_AFTER of the 30-day lifetime has passed since a logged-in session was last written, it is rewritten and its expiration clock resets to another 30 days. So if they visit on day 20, they stay logged in until about day 50. Requests in between (e.g. /api/health polling) write nothing unless they change the session.
 def extend_session_if_active():
-    session.permanent = True
-    app.permanent_session_lifetime = timedelta(days=30)
+    if not session.permanent:
+        session.permanent = True
+
+    if session.get('user_id') or session.get('admin_id'):
+        now = int(time.time())
+        if now - session.get('_refreshed_at', 0) >= app.permanent_session_lifetime.total_seconds() * SESSION_REFRESH_AFTER:
+            session['_refreshed_at'] = now # marks the session modified, so it is saved with a new expiry
+
+profiler.init_app(app) # opt-in per-request cProfile + SQL capture (X-Profile header from an admin, or PROFILE_SAMPLE_RATE)
 
-    if 'user_id' or 'admin_id' in session:
-        session.modified = True
+def current_user():
+    """The logged-in user as a read-only UserRow (None if logged out), looked up at most once per request."""
+    if 'current_user' not in g:
+        g.current_user = db_obj.get_user_row(session['user_id']) if session.get('user_id') else None
+    return g.current_user
+
+def current_admin():
+    """The logged-in Admin (None if logged out), looked up at most once per request."""
+    if 'current_admin' not in g:
+        g.current_admin = db.session.get(Admin, session['admin_id']) if session.get('admin_id') else None
+    return g.current_admin
 
 def add_pepper(password: str) -> str:
     """
@@ -207,18 +239,15 @@ def adminGetAllUser():
     if not session.get('admin_id'): # if admin is not logged in
         return redirect('/admin/')
     
-    if request.method == "POST":
-        search_term = request.form.get('search')
+    search_term = request.values.get('search', '').strip() # the search form posts it, the next-page link passes it in the URL
+    if request.method == "POST" and search_term == '':
+        flash('Please enter search term','warning')
 
-        if search_term == '':
-            flash('Please enter search term','warning')
-        
-        users = db_obj.search_users_by_name_or_email_or_id(search_term)
-    else:
-        users = db_obj.get_all_users()
+    users, next_after = db_obj.search_users_by_name_or_email_or_id(search_term, after=request.args.get('after')) # one page, not every user
     totalUsers, totalApprove, NotTotalApprove = db_obj.get_user_db_stat()
     
-    return render_template('admin/manage-users.html', title = 'Manage Users', users = users, totalUsers = totalUsers, totalApprove = totalApprove, NotTotalApprove = NotTotalApprove)
+    return render_template('admin/manage-users.html', title = 'Manage Users', users = users, totalUsers = totalUsers, totalApprove = totalApprove, NotTotalApprove = NotTotalApprove,
+                           search_term = search_term, next_after = next_after, first_page = request.args.get('after') is None)
 
 @app.route('/admin/approve-user/<int:user_id>')
 def adminApprove(user_id):
@@ -248,7 +277,7 @@ def adminChangePassword():
     if not session.get('admin_id'): # if admin is not logged in
         return redirect('/admin/')
 
-    admin = db_obj.get_admin_by_email(admin_email=session['admin_email']) # fetch admin details from database.
+    admin = current_admin() # fetch admin details from database.
 
     if request.method == 'POST':
         admin_name = request.form.get('admin_name')
@@ -383,11 +412,11 @@ def googleLogin():
     # Generate a redirect URL for Google authentication and send the user there
     redirect_uri = url_for("googleCallback", _external=True) # Generate an absolute URL for the callback
 
-    return oauth.myApp.authorize_redirect(redirect_uri=redirect_uri)
+    return get_oauth().myApp.authorize_redirect(redirect_uri=redirect_uri)
 
 @app.route('/user/signin_google') # Route for handling the OAuth callback from Google
 def googleCallback():
-    token = oauth.myApp.authorize_access_token() # Get the authentication token after successful login
+    token = get_oauth().myApp.authorize_access_token() # Get the authentication token after successful login
     visitorId = session.pop("visitorId", None)  # 🔐 retrieve & delete
 
     user_email = token.get("userinfo", {}).get("email") # Extract user email from Google OAuth response
@@ -426,7 +455,7 @@ def userDashboard():
     if not session.get('user_id'):
         return redirect('/user/')
     
-    user = db_obj.get_user_by_email(session['user_email'])
+    user = current_user()
 
     return render_template('user/dashboard.html', title="User Dashboard", user=user)
 
@@ -436,7 +465,7 @@ def userSentimentAnalyzer():
     if not session.get('user_id'):
         return redirect('/user/')
     
-    user = db_obj.get_user_by_email(user_email=session['user_email'])
+    user = current_user()
 
     return render_template('user/sentiment-analyzer.html', title="Sentiment Analyzer", user=user)
 
@@ -469,7 +498,7 @@ def create_order():
     amount = int(data["amount"]) * 100 # amount in paise
 
     try : 
-        razorpay_order = razorpay_client.order.create(data={"amount": amount,"currency": 'INR'})
+        razorpay_order = get_razorpay_client().order.create(data={"amount": amount,"currency": 'INR'})
 
         try :
             r_status = db_obj.register_new_order(order_id=razorpay_order['id'], amount=razorpay_order['amount'], currency='INR', payment_status=razorpay_order['status'], user_id=session['user_id'], booking_type='TOKEN')
@@ -507,7 +536,7 @@ def verify_signature():
     signature = request.form.get("razorpay_signature")
 
     try: # Verify signature
-        razorpay_client.utility.verify_payment_signature({"razorpay_order_id": order_id, "razorpay_payment_id": payment_id, "razorpay_signature": signature})
+        get_razorpay_client().utility.verify_payment_signature({"razorpay_order_id": order_id, "razorpay_payment_id": payment_id, "razorpay_signature": signature})
         
 
         try :
@@ -566,6 +595,54 @@ def health_check():
         return jsonify({"status": "ok", "logged_in": True, "admin_id": session['admin_id']})
     return jsonify({"status": "not_logged_in", "logged_in": False}), 200
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text metrics of all gunicorn workers, for an admin session or a bearer METRICS_TOKEN."""
+
+    token = os.getenv('METRICS_TOKEN')
+    if not session.get('admin_id') and not (token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")):
+        return jsonify({"error": "Admin not logged in"}), 401
+
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiles')
+def adminProfiles():
+    """The stored request profiles (newest first), captured by utils.profiler."""
+
+    if not session.get('admin_id'):
+        return jsonify({"error": "Admin not logged in"}), 401
+
+    return jsonify({"profiles": profiler.list_profiles()})
+
+@app.route('/admin/profiles/<profile_id>')
+def adminProfile(profile_id):
+    """One profile: its SQL statements and cumulative-time table as JSON, or the raw pstats file with ?format=pstats."""
+
+    if not session.get('admin_id'):
+        return jsonify({"error": "Admin not logged in"}), 401
+
+    if request.args.get('format') == 'pstats':
+        path = profiler.profile_path(profile_id, 'prof')
+        if path is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True, download_name=f"{profile_id}.prof")
+
+    path = profiler.profile_path(profile_id, 'json')
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), mimetype='application/json')
+
+@app.route('/api/cache_stats')
+def cache_stats():
+
+    if not session.get('admin_id'):
+        return jsonify({"error": "Admin not logged in"}), 401
+
+    stats = {"comments": satya.comment_cache.stats(), "renders": satya.render_stats()} # counters of this worker
+    if isinstance(app.session_interface, sessions.SQLiteSessionInterface):
+        stats["sessions"] = app.session_interface.stats()
+    return jsonify(stats)
+
 @csrf.exempt
 @app.route('/api/generate_chart', methods=['POST'])
 def generate_chart():
@@ -597,35 +674,171 @@ def generate_trend_graph():
     return response
 
 @csrf.exempt
-@app.route('/api/analyze_video', methods=['POST'])
-def analyze_video():
-    data = request.get_json()
+@app.route('/api/sentiment_trend', methods=['POST'])
+def sentiment_trend():
+
+    if not session.get('user_id') and not session.get('admin_id'):
+        return jsonify({"error": "User not logged in"}), 401
+
+    response = satya.get_sentiment_trend(request)
+    return response
+
+@csrf.exempt
+@app.route('/api/chart_bundle', methods=['POST'])
+def chart_bundle():
+    """Pie chart, word cloud and trend graph of an analyzed video in one response, rendered from the server-held result."""
+
+    if not session.get('user_id') and not session.get('admin_id'):
+        return jsonify({"error": "User not logged in"}), 401
 
+    video_id = (request.get_json(silent=True) or {}).get('videoId')
+    if not video_id:
+        return jsonify({"error": "No Video ID provided"}), 400
+
+    bundle = satya.render_chart_bundle(video_id, request.if_none_match)
+    if bundle is None:
+        return jsonify({"error": "No analysis found for this video. Analyze it first."}), 404
+    if bundle.get('not_modified'):
+        response = Response(status=304)
+    else:
+        response = jsonify({"videoId": video_id, "mimetype": "image/png", "charts": bundle["charts"], "errors": bundle["errors"]})
+    if bundle["etag"]:
+        response.set_etag(bundle["etag"])
+    return response
+
+def authorize_analysis(video_ids, visitorId):
+    """
+    Checks the login, the video and visitor IDs, the device and the balance, and deducts one credit per video, the last
+    three in a single conditional UPDATE. Returns an error response, or None if the analysis may run.
+    """
     if session.get('user_id'):
-        video_id = data.get('videoId')
-        visitorId = data.get("visitorId")
-        if not video_id or not visitorId:
+        if not video_ids or not visitorId:
             return jsonify({"error": "No Video ID or Visitor ID provided"}), 400
-        if not db_obj.check_user_device(session['user_id'], visitorId):
+        balance, reason = db_obj.debit_user_credits(session['user_id'], visitorId, amount=len(video_ids), service_name='SATYA')
+        if reason == 'unknown device':
             return jsonify({"error": "Request from unknown device"}), 400
-        db_obj.update_user_credits(session['user_id'], amount=1, service_name='SATYA')
+        if reason == 'insufficient credits':
+            return jsonify({"error": "Not enough credits", "credits_needed": len(video_ids)}), 402
+        g.credit_debit = {"user_id": session['user_id'], "amount": len(video_ids), "balance": balance} # for refund_analysis
         
     elif session.get('admin_id'):
-        video_id = data.get('videoId')
-        visitorId = data.get("visitorId")
-        if not video_id or not visitorId:
+        if not video_ids or not visitorId:
             return jsonify({"error": "No Video ID or Visitor ID provided"}), 400
-        if not db_obj.check_admin_device(session['admin_id'], visitorId):
+        if current_admin() is None or current_admin().device_id != visitorId:
             return jsonify({"error": "Request from unknown device"}), 400
         
     else:
         return jsonify({"error": "User not logged in"}), 401
     
-    results = satya.analyze_youtube_video(video_id)
+    return None
+
+def refund_analysis(videos=None):
+    """Gives back the credits authorize_analysis debited for videos that failed to analyze (all of them by default)."""
+    debit = g.get('credit_debit')
+    if not debit:
+        return
+    amount = debit["amount"] if videos is None else min(videos, debit["amount"])
+    if amount and db_obj.refund_user_credits(debit["user_id"], amount=amount, service_name='SATYA'):
+        debit["amount"] -= amount
+        debit["balance"] = None # no longer known without another query
+
+@app.after_request
+def add_credit_balance(response):
+    debit = g.get('credit_debit')
+    if debit and debit["balance"] is not None:
+        response.headers['X-Credits-Balance'] = str(debit["balance"])
+    return response
+
+@app.teardown_request
+def refund_on_exception(exc): # an analysis that crashed was not delivered either
+    if exc is not None and g.get('credit_debit'):
+        try:
+            refund_analysis()
+        except Exception as e:
+            print(f"Error refunding credits: {e}")
+
+@csrf.exempt
+@app.route('/api/analyze_video', methods=['POST'])
+def analyze_video():
+    data = request.get_json()
+    video_id = data.get('videoId')
+
+    error = authorize_analysis([video_id] if video_id else [], data.get("visitorId"))
+    if error:
+        return error
+    
+    results = satya.analyze_youtube_video(video_id, incremental=bool(data.get('incremental')))
     if isinstance(results, dict) and "error" in results:
+        refund_analysis()
         return jsonify(results), 500
-        
-    return jsonify(results)
+
+    with metrics.timer('satya_stage_duration_seconds', stage='serialize'):
+        return jsonify(results)
+
+@csrf.exempt
+@app.route('/api/analyze_video/stream', methods=['POST'])
+def analyze_video_stream():
+    """
+    Same as /api/analyze_video, but streams newline-delimited JSON: one {"type": "comments"} record per
+    classified page, then a {"type": "summary"} record with the sentiment counts (or a {"type": "error"} record).
+    """
+    data = request.get_json()
+    video_id = data.get('videoId')
+
+    error = authorize_analysis([video_id] if video_id else [], data.get("visitorId"))
+    if error:
+        return error
+
+    pages = satya.iter_analyzed_pages(video_id, incremental=bool(data.get('incremental')))
+    first_page = next(pages)
+    if isinstance(first_page, dict): # failed before any comment was classified
+        refund_analysis()
+        return jsonify(first_page), 500
+
+    @stream_with_context # keeps the request context (g, the database session) for the refund
+    def generate():
+        results = []
+        for page in chain([first_page], pages):
+            if isinstance(page, dict):
+                refund_analysis() # the summary is never delivered
+                yield json.dumps({"type": "error", **page}) + "\n"
+                return
+            results.extend(page)
+            with metrics.timer('satya_stage_duration_seconds', stage='serialize'):
+                record = json.dumps({"type": "comments", "comments": page}) + "\n"
+            yield record
+        yield json.dumps({"type": "summary", **satya.sentiment_summary(results)}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}) # no proxy buffering
+
+@csrf.exempt
+@app.route('/api/analyze_videos', methods=['POST'])
+def analyze_videos():
+    """
+    Analyzes a list of videos in one request: comment pages are fetched concurrently and all comments are
+    classified in one combined pass. Returns per-video results and summaries; one credit per video is debited at once.
+    """
+    data = request.get_json()
+    video_ids = data.get('videoIds')
+
+    if not isinstance(video_ids, list) or not all(isinstance(video_id, str) and video_id for video_id in video_ids):
+        return jsonify({"error": "videoIds must be a list of Video IDs"}), 400
+    video_ids = list(dict.fromkeys(video_ids)) # drop duplicates, keep order
+    if len(video_ids) > satya.MAX_BATCH_VIDEOS:
+        return jsonify({"error": f"At most {satya.MAX_BATCH_VIDEOS} videos can be analyzed at once"}), 400
+
+    error = authorize_analysis(video_ids, data.get("visitorId"))
+    if error:
+        return error
+
+    results = satya.analyze_youtube_videos(video_ids)
+    if "error" in results:
+        refund_analysis()
+        return jsonify(results), 500
+    refund_analysis(videos=sum(isinstance(result, dict) for result in results["results"].values())) # videos that failed on their own
+
+    with metrics.timer('satya_stage_duration_seconds', stage='serialize'):
+        return jsonify(results)
 
 # ----------------------------------- Model 2 ----------------------------------
 
@@ -634,6 +847,11 @@ def analyze_video():
 
 
 
+@app.cli.command('reindex-user-search')
+def reindex_user_search(): # run once after deploying the search index: flask --app app reindex-user-search
+    db.create_all() # creates the user_search_token table if it does not exist
+    print(f"Indexed {db_obj.reindex_user_search()} users")
+
 if __name__=="__main__":
     with app.app_context():
         db.create_all() # create the database if not created
@@ -0,0 +1,180 @@
+# Local stand-in for the YouTube Data API commentThreads endpoint, for repeatable end-to-end load tests.
+# To run it: python -m benchmarks.fake_youtube --port 8100 --delay 0.2
+# Then start the app with YOUTUBE_API_BASE_URL=http://127.0.0.1:8100/youtube/v3
+#
+# Comments are generated deterministically from the video ID: sentiment-bearing text with emoji, links, timestamps
+# and verbatim repeats, published newest first with a burst after upload and a long tail.
+# Errors can be injected per video or at random:
+# - a video ID starting with quotaExceeded, commentsDisabled, videoNotFound or backendError always fails with it
+# - a video ID starting with flaky fails each page once with a 503 before it succeeds (exercises the client's retries)
+# - --error-rate 0.1 --errors quotaExceeded backendError fails that share of all requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import threading, argparse, base64, random, json, time
+
+WORDS = "great video thanks love this tutorial not helpful bad audio amazing explanation why so long best channel boring clear useful".split()
+
+POSITIVE = ["This is exactly what I needed, thank you so much", "Best explanation on YouTube", "Amazing video as always",
+            "You deserve way more subscribers", "Finally someone explains it clearly", "Loved the editing in this one",
+            "This channel never disappoints", "Great content, keep it up", "Watched it twice, so good", "Super helpful, subscribed"]
+NEUTRAL = ["What software do you use for this?", "Can you make a video on the next part?", "Watching from India",
+           "Who else is here after the update?", "Is this still relevant in 2025?", "The link in the description doesn't open for me",
+           "Which microphone is that?", "Part 2 when?", "I came here from the podcast", "Does this work on Mac too?"]
+NEGATIVE = ["The audio is really bad in this one", "Too long, could have been 5 minutes", "This is misleading, the title is clickbait",
+            "Honestly one of the worst tutorials I've seen", "You skipped the most important step", "Way too many ads",
+            "Didn't work for me at all, waste of time", "The background music is so annoying", "Unsubscribed, quality dropped a lot",
+            "Wrong information at the start"]
+EXTRAS = ["", "", "", "!", "!!", " 😂😂", " 🔥🔥🔥", " ❤️", " 👍", " at {stamp}", " ({stamp})", "\n\nEdit: thanks for the likes!",
+          " https://example.com/notes", " @creator", " 10/10", "..."]
+REPEATED = ["First!", "Nice video", "❤️❤️❤️", "Who is watching in 2025?", "Early squad"] # posted verbatim by many viewers
+
+ERRORS = { # reason -> (HTTP status, domain, message), as the real API returns them
+    'quotaExceeded': (403, 'youtube.quota', "The request cannot be completed because you have exceeded your quota."),
+    'commentsDisabled': (403, 'youtube.commentThread', "The video identified by the videoId parameter has disabled comments."),
+    'videoNotFound': (404, 'youtube.commentThread', "The video identified by the videoId parameter could not be found."),
+    'backendError': (503, 'global', "The service is currently unavailable."),
+}
+MAX_RESULTS = 100 # the real API's limit per page
+
+def comment_text(rng):
+    if rng.random() < 0.06:
+        return rng.choice(REPEATED)
+    pool = rng.choices((POSITIVE, NEUTRAL, NEGATIVE), weights=(5, 3, 2))[0]
+    sentences = [rng.choice(pool) for _ in range(rng.choices((1, 2, 3), weights=(6, 3, 1))[0])]
+    text = '. '.join(sentences)
+    if rng.random() < 0.15:
+        text = text.lower()
+    stamp = f"{rng.randint(0, 25)}:{rng.randint(0, 59):02d}"
+    return text + rng.choice(EXTRAS).format(stamp=stamp)
+
+@lru_cache(maxsize=64)
+def make_comments(video_id, total):
+    """Deterministic commentThreads items for a video_id, newest first like order=time."""
+    rng = random.Random(video_id)
+    uploaded = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(hours=rng.randrange(24 * 180))
+    # most comments arrive within days of the upload, then a long tail over months
+    published = sorted((uploaded + timedelta(seconds=min(rng.expovariate(1 / (3 * 86400)), 400 * 86400)) for _ in range(total)), reverse=True)
+    authors = [f"UC{rng.randrange(16 ** 22):022x}" for _ in range(max(1, total * 3 // 4))] # some viewers comment more than once
+    items = []
+    for i, when in enumerate(published):
+        text = comment_text(rng)
+        author = rng.choice(authors)
+        timestamp = when.strftime('%Y-%m-%dT%H:%M:%SZ')
+        items.append({
+            'kind': 'youtube#commentThread',
+            'id': f"Ug{video_id}{i:05d}",
+            'snippet': {
+                'videoId': video_id,
+                'canReply': True,
+                'totalReplyCount': rng.choices((0, 1, 5), weights=(8, 2, 1))[0],
+                'isPublic': True,
+                'topLevelComment': {'kind': 'youtube#comment', 'id': f"Ug{video_id}{i:05d}", 'snippet': {
+                    'textDisplay': text.replace('\n', '<br>'),
+                    'textOriginal': text,
+                    'authorDisplayName': f"@viewer{author[-6:]}",
+                    'authorChannelId': {'value': author},
+                    'likeCount': min(int(rng.paretovariate(1.2)) - 1, 100000),
+                    'publishedAt': timestamp,
+                    'updatedAt': timestamp,
+                }}
+            }
+        })
+    return items
+
+def encode_page_token(offset):
+    return base64.urlsafe_b64encode(f"offset:{offset}".encode()).decode().rstrip('=')
+
+def decode_page_token(token):
+    """The offset of a page token, or None if the token is not one of ours."""
+    try:
+        kind, _, offset = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().partition(':')
+        return int(offset) if kind == 'offset' else None
+    except ValueError:
+        return None
+
+def error_body(reason):
+    status, domain, message = ERRORS[reason]
+    return status, {'error': {'code': status, 'message': message, 'errors': [{'message': message, 'domain': domain, 'reason': reason}]}}
+
+def make_handler(delay, total, jitter=0.0, error_rate=0.0, errors=('backendError',), seed=0):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    flaky_seen = set() # (video_id, offset) pages that already failed once
+    stats = {'requests': 0, 'errors': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, like the real API
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if not url.path.endswith('/commentThreads'):
+                return self.reply(404, {'error': {'code': 404, 'message': "Not Found", 'errors': [{'reason': 'notFound'}]}})
+            video_id = query.get('videoId', [''])[0]
+            token = query.get('pageToken', [''])[0]
+            offset = decode_page_token(token) if token else 0
+            limit = min(int(query.get('maxResults', ['20'])[0]), MAX_RESULTS)
+            with rng_lock:
+                stats['requests'] += 1
+                pause = delay + (rng.uniform(0, jitter) if jitter else 0)
+                injected = rng.choice(errors) if error_rate and rng.random() < error_rate else None
+            time.sleep(pause)
+
+            reason = next((name for name in ERRORS if video_id.startswith(name)), None) or injected
+            if reason is None and video_id.startswith('flaky') and (video_id, offset) not in flaky_seen:
+                flaky_seen.add((video_id, offset))
+                reason = 'backendError'
+            if reason is not None:
+                stats['errors'] += 1
+                return self.reply(*error_body(reason))
+            if offset is None:
+                message = "The request specifies an invalid page token."
+                return self.reply(400, {'error': {'code': 400, 'message': message, 'errors': [{'message': message, 'domain': 'youtube.parameter', 'reason': 'invalidPageToken'}]}})
+
+            comments = make_comments(video_id, total)
+            body = {'kind': 'youtube#commentThreadListResponse',
+                    'pageInfo': {'totalResults': len(comments[offset:offset + limit]), 'resultsPerPage': limit},
+                    'items': comments[offset:offset + limit]}
+            if offset + limit < total:
+                body['nextPageToken'] = encode_page_token(offset + limit)
+            self.reply(200, body)
+
+        def reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    Handler.stats = stats
+    return Handler
+
+def serve(port=0, delay=0.2, total=500, jitter=0.0, error_rate=0.0, errors=('backendError',), seed=0):
+    """
+    Starts the stand-in on a background thread and returns the server (server.server_port holds the port).
+    server.RequestHandlerClass.stats counts the requests served and the errors injected.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(delay, total, jitter, error_rate, errors, seed))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake YouTube commentThreads API")
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--delay', type=float, default=0.2, help="seconds of artificial latency per page")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds of random latency per page")
+    parser.add_argument('--comments', type=int, default=500, help="comments per video")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests that fail with one of --errors")
+    parser.add_argument('--errors', nargs='+', choices=list(ERRORS), default=['backendError'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.delay, args.comments, args.jitter, args.error_rate, args.errors, args.seed))
+    print(f"Serving on http://127.0.0.1:{args.port}/youtube/v3/commentThreads")
+    server.serve_forever()
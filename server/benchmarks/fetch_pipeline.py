@@ -0,0 +1,37 @@
+# Compares the sequential fetch-then-classify path with the pipelined analyze_youtube_video.
+# To run it (from server/): python -m benchmarks.fetch_pipeline --delay 0.2
+import argparse, time, os
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delay', type=float, default=0.2, help="seconds of artificial latency per page")
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    from benchmarks.fake_youtube import serve
+    server = serve(delay=args.delay)
+    os.environ['YOUTUBE_API_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/youtube/v3"
+    os.environ['COMMENT_CACHE_PATH'] = '' # measure the network path, not the cache
+    from utils import satya, youtube
+
+    def sequential(video_id):
+        return satya.classify_comments(youtube.fetch_youtube_comments(video_id))
+
+    def pipelined(video_id):
+        satya.comment_cache.delete(video_id)
+        return satya.analyze_youtube_video(video_id)
+
+    for name, fn in (('sequential', sequential), ('pipelined', pipelined)):
+        timings = []
+        for run in range(args.runs):
+            start = time.perf_counter()
+            result = fn(f"video{run}")
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<10} best {min(timings) * 1000:.0f} ms  ({len(result)} comments)")
+
+    assert sequential('check') == pipelined('check'), "pipelined result differs from sequential"
+    print("results identical")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Microbenchmarks of each satya pipeline stage on deterministic synthetic corpora.
+# Times preprocessing, vectorizing, prediction, response formatting and the three chart renderers, reports the
+# peak memory of each stage, and can compare against a previous run.
+# To run it (from server/):
+#   python -m benchmarks.pipeline_stages --out baseline.json
+#   python -m benchmarks.pipeline_stages --compare baseline.json --threshold 0.2   # exits 1 on a regression
+from datetime import datetime, timedelta, timezone
+import statistics, tracemalloc, argparse, platform, random, json, time, sys, os
+
+SIZES = [100, 500, 10000, 100000]
+WORDS = ("great video thanks love this tutorial not helpful bad audio amazing explanation why so long best channel boring clear useful "
+         "awesome terrible worst ever really good nice informative confusing loved hated music editing quality subscribed "
+         "please make more content like part two waiting for next one cannot understand accent slow fast perfect wow "
+         "funny hilarious sad disappointed excellent work keep going brilliant idea wrong information misleading title").split()
+EXTRAS = ["!", "!!", "?", "...", " :)", " 😂", " 🔥", " https://youtu.be/x", " 10/10", " @creator"]
+REPEATED = ["First!", "Nice video", "Who is watching in 2025?", "❤️❤️❤️"] # comments that many viewers post verbatim
+
+def make_corpus(size, seed=0):
+    """size comments in the shape of youtube.iter_comment_pages output, newest first over roughly a year."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    comments = []
+    for i in range(size):
+        if rng.random() < 0.05:
+            text = rng.choice(REPEATED)
+        else:
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))
+            text = (text.capitalize() if rng.random() < 0.5 else text) + rng.choice(EXTRAS)
+        comments.append({
+            'id': f"c{i}",
+            'text': text,
+            'timestamp': (start - timedelta(seconds=i * 365 * 86400 // size)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'authorId': f"UC{rng.randrange(size):08d}"
+        })
+    return comments
+
+def stages(satya, corpus):
+    """(name, fn) pairs; each fn runs one stage on inputs computed once up front."""
+    texts = [comment['text'] for comment in corpus]
+    preprocessed = satya.preprocess_batch(texts)
+    transformed = satya.vectorizer.transform(preprocessed)
+    predictions, confidence_scores = satya.predict_sentiment(transformed)
+    formatted = satya.format_results(corpus, preprocessed, predictions, confidence_scores)
+    counts = satya.sentiment_summary(formatted)["sentiment_counts"]
+    sentiment_data = [{"timestamp": record["timestamp"], "sentiment": record["sentiment"]} for record in formatted]
+
+    def preprocess():
+        satya.lemmatize.cache_clear() # measure a cold lemma cache, as after a restart
+        return satya.preprocess_batch(texts)
+
+    return [
+        ('preprocess', preprocess),
+        ('vectorize', lambda: satya.vectorizer.transform(preprocessed)),
+        ('predict', lambda: satya.predict_sentiment(transformed)),
+        ('format', lambda: satya.format_results(corpus, preprocessed, predictions, confidence_scores)),
+        ('serialize', lambda: json.dumps(formatted)),
+        ('render_chart', lambda: satya.render_chart(counts)),
+        ('render_wordcloud', lambda: satya.render_wordcloud(preprocessed)),
+        ('render_trend_graph', lambda: satya.render_trend_graph(sentiment_data)),
+    ]
+
+def measure(fn, runs):
+    """Best and median seconds over runs, then the peak traced memory (MB) of one more run under tracemalloc."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"best": min(timings), "median": statistics.median(timings), "peak_mb": round(peak / 2**20, 3)}
+
+def environment():
+    versions = {}
+    for name in ('numpy', 'sklearn', 'lightgbm', 'nltk', 'matplotlib', 'wordcloud'):
+        try:
+            versions[name] = __import__(name).__version__
+        except Exception:
+            versions[name] = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(), "versions": versions}
+
+def compare(results, baseline, threshold, min_ms, min_mb):
+    """Lines describing every stage that got slower or bigger than baseline by more than threshold (a fraction)."""
+    regressions = []
+    for size, stage_results in results.items():
+        for stage, current in stage_results.items():
+            previous = baseline.get(size, {}).get(stage)
+            if previous is None:
+                continue
+            if current["best"] * 1000 >= min_ms and current["best"] > previous["best"] * (1 + threshold):
+                regressions.append(f"{stage} @ {size}: {previous['best'] * 1000:.1f} -> {current['best'] * 1000:.1f} ms")
+            if current["peak_mb"] >= min_mb and current["peak_mb"] > previous["peak_mb"] * (1 + threshold):
+                regressions.append(f"{stage} @ {size}: {previous['peak_mb']:.1f} -> {current['peak_mb']:.1f} MB peak")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Satya pipeline stage benchmarks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--stages', nargs='+', help="only these stages (default: all)")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--out', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file from an earlier --out")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown or memory growth, as a fraction (0.2 = 20%%)")
+    parser.add_argument('--min-ms', type=float, default=5, help="ignore time regressions of stages faster than this")
+    parser.add_argument('--min-mb', type=float, default=1, help="ignore memory regressions of stages below this peak")
+    args = parser.parse_args()
+
+    os.environ.pop('SATYA_INFERENCE_SOCKET', None) # benchmark the in-process model
+    from utils import satya
+    satya.warm_up()
+
+    results = {}
+    for size in args.sizes:
+        corpus = make_corpus(size)
+        results[str(size)] = {}
+        for stage, fn in stages(satya, corpus):
+            if args.stages and stage not in args.stages:
+                continue
+            result = measure(fn, args.runs)
+            results[str(size)][stage] = result
+            print(f"{size:>7} {stage:<20} best {result['best'] * 1000:9.1f} ms  median {result['median'] * 1000:9.1f} ms  peak {result['peak_mb']:8.1f} MB", flush=True)
+
+    report = {"environment": environment(), "runs": args.runs, "results": results}
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_ms, args.min_mb)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} of {args.compare}")
+        return not regressions
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,59 @@
+# Checks that chart renders on many threads at once give the same PNGs as sequential renders, and that the render
+# queue limit rejects work past its depth.
+# To run it (from server/): python -m benchmarks.render_concurrency --renders 32
+from concurrent.futures import ThreadPoolExecutor
+import argparse, hashlib, random, time, os
+
+def sample_payloads(count):
+    """count different (name, render, payload) jobs cycling through the three chart kinds."""
+    from utils import satya
+    from benchmarks.fake_youtube import WORDS
+    jobs = []
+    for i in range(count):
+        rng = random.Random(i)
+        if i % 3 == 0:
+            jobs.append(('chart', satya.render_chart, {key: rng.randint(1, 200) for key in ('1', '0', '-1')}))
+        elif i % 3 == 1:
+            jobs.append(('wordcloud', satya.render_wordcloud, [' '.join(rng.choice(WORDS) for _ in range(8)) for _ in range(200)]))
+        else:
+            data = [{"timestamp": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00Z", "sentiment": rng.choice((-1, 0, 1))} for _ in range(300)]
+            jobs.append(('trend_graph', satya.render_trend_graph, data))
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--renders', type=int, default=32, help="renders submitted at the same time")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SATYA_RENDER_QUEUE_DEPTH', str(args.renders)) # room for the whole burst
+    from utils import satya
+    from utils.render import RenderPool, RenderQueueFull
+    jobs = sample_payloads(args.renders)
+
+    start = time.perf_counter()
+    expected = [hashlib.sha256(render(payload)).hexdigest() for _, render, payload in jobs]
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.renders) as clients: # one request thread per render, all through render_pool
+        pngs = list(clients.map(lambda job: satya.render_pool.run(job[1], job[2]), jobs))
+    concurrent = time.perf_counter() - start
+
+    mismatches = [name for (name, _, _), png, digest in zip(jobs, pngs, expected) if hashlib.sha256(png).hexdigest() != digest]
+    print(f"sequential {sequential * 1000:.0f} ms, {args.renders} concurrent {concurrent * 1000:.0f} ms")
+    print(f"identical PNGs: {args.renders - len(mismatches)}/{args.renders}" + (f"  mismatched: {mismatches}" if mismatches else ""))
+
+    pool = RenderPool(threads=1, queue_depth=2) # 1 running + 2 waiting
+    futures, rejected = [], 0
+    for _ in range(5):
+        try:
+            futures.append(pool.submit(time.sleep, 0.2))
+        except RenderQueueFull:
+            rejected += 1
+    for future in futures:
+        future.result()
+    print(f"queue limit: {len(futures)} accepted, {rejected} rejected (expected 3 and 2)")
+    return not mismatches and rejected == 2
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,89 @@
+# Session read/write latency and expiry sweep cost with 100k live sessions: the SQLite session store
+# (utils/sessions.py) against Flask-Session's filesystem backend (cachelib FileSystemCache, one file per session)
+# swept the way app.clear_expired_sessions does it.
+# To run it (from server/): python -m benchmarks.session_store --live 100000 --expired 20000
+from datetime import timedelta
+from flask import Flask
+import statistics, tempfile, argparse, secrets, random, glob, time, os
+
+def session_data(i):
+    """What a logged-in user's session holds."""
+    return {"_permanent": True, "user_id": i, "user_name": f"User {i}", "user_email": f"user{i}@example.com", "csrf_token": secrets.token_hex(20)}
+
+def timings(fn, keys):
+    """p50 and p99 microseconds of fn(key) over keys."""
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        fn(key)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--live', type=int, default=100000)
+    parser.add_argument('--expired', type=int, default=20000)
+    parser.add_argument('--ops', type=int, default=5000, help="reads or writes per measurement")
+    parser.add_argument('--skip-filesystem', action='store_true')
+    args = parser.parse_args()
+
+    from utils.sessions import SQLiteSessionInterface, SQLiteSession
+    app = Flask(__name__)
+    lifetime, expired = timedelta(days=30), timedelta(seconds=-1)
+    rng = random.Random(0)
+    ids = [f"session:{secrets.token_urlsafe(32)}" for _ in range(args.live + args.expired)]
+    live, dead = ids[:args.live], ids[args.live:]
+    sample = rng.sample(live, args.ops)
+    directory = tempfile.mkdtemp()
+
+    store = SQLiteSessionInterface(app, path=os.path.join(directory, 'sessions.db'), sweep_interval=0)
+    start = time.perf_counter()
+    for i, store_id in enumerate(ids):
+        store._upsert_session(lifetime if i < args.live else expired, SQLiteSession(session_data(i), sid=store_id), store_id)
+    print(f"sqlite      seeded {len(ids)} sessions in {time.perf_counter() - start:.1f} s")
+    print(f"sqlite      write           p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(lambda key: store._upsert_session(lifetime, SQLiteSession(session_data(1), sid=key), key), sample)))
+    store.memory.clear()
+    print(f"sqlite      read (disk)     p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(lambda key: (store.memory.clear(), store._retrieve_session_data(key)), sample)))
+    hot = sample[:store.memory.max_entries // 2] # recently active users, which fit in the memory tier
+    for key in hot:
+        store._retrieve_session_data(key)
+    print(f"sqlite      read (memory)   p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(store._retrieve_session_data, (hot * args.ops)[:args.ops])))
+    missing = [f"session:{secrets.token_urlsafe(32)}" for _ in range(args.ops)]
+    print(f"sqlite      read (unknown)  p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(store._retrieve_session_data, missing)))
+    ok = all(store._retrieve_session_data(key) is None for key in dead[:100])
+
+    start = time.perf_counter()
+    swept = store._delete_expired_sessions()
+    seconds = time.perf_counter() - start
+    print(f"sqlite      sweep of {swept} expired sessions: {seconds * 1000:.1f} ms in batches of {store.sweep_batch}")
+    start = time.perf_counter()
+    store._delete_expired_sessions()
+    print(f"sqlite      sweep with nothing expired: {(time.perf_counter() - start) * 1e6:.0f} us")
+    stats = store.stats()
+    ok &= swept == args.expired and stats["live"] == args.live
+    print(f"sqlite      {stats}")
+
+    if not args.skip_filesystem:
+        from cachelib.file import FileSystemCache
+        files = os.path.join(directory, 'flask_session')
+        cache = FileSystemCache(cache_dir=files, threshold=0) # no pruning; Flask-Session's default threshold of 500 would drop sessions past 500
+        start = time.perf_counter()
+        for i, store_id in enumerate(ids):
+            cache.set(store_id, session_data(i), timeout=int(lifetime.total_seconds()) if i < args.live else 1)
+        print(f"filesystem  seeded {len(ids)} sessions in {time.perf_counter() - start:.1f} s")
+        print(f"filesystem  write           p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(lambda key: cache.set(key, session_data(1), timeout=int(lifetime.total_seconds())), sample)))
+        print(f"filesystem  read            p50 {{:7.1f}} us  p99 {{:7.1f}} us".format(*timings(cache.get, sample)))
+        start = time.perf_counter()
+        stale = 0
+        cutoff = time.time() - lifetime.total_seconds()
+        for session_file in glob.glob(os.path.join(files, '*')): # app.clear_expired_sessions, minus the removals
+            if os.stat(session_file).st_mtime < cutoff:
+                stale += 1
+        print(f"filesystem  sweep (glob + stat of every file): {(time.perf_counter() - start) * 1000:.1f} ms, on every run, for {stale} expired")
+
+    print(f"expired sessions are not served and the sweep removed exactly them: {ok}")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,88 @@
+# Load test of session storage writes: logged-in clients poll /api/health (as the extension does) every few minutes
+# over a simulated month, next to anonymous pollers, and the SQLite session store counts the sessions it saves.
+# Compares the previous extend_session_if_active (every request rewrites the session) with the sliding refresh
+# that rewrites it once SESSION_REFRESH_AFTER of the lifetime has passed, and checks that changed sessions are
+# still saved at once and that polling sessions never expire.
+# To run it (from server/): python -m benchmarks.session_writes --clients 5 --days 30 --every 300
+from unittest import mock
+from flask import session
+import tempfile, argparse, time, os
+
+def previous_extend_session_if_active(): # extend_session_if_active before the sliding refresh
+    session.permanent = True
+    if 'user_id' or 'admin_id' in session:
+        session.modified = True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=5, help="logged-in clients (and as many anonymous ones)")
+    parser.add_argument('--days', type=float, default=30, help="simulated days of polling")
+    parser.add_argument('--every', type=float, default=300, help="seconds between two polls of one client")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.1, 0.01])
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("--clients must be at least 2 (one session is left idle, another is checked for expiry)")
+
+    directory = tempfile.mkdtemp()
+    os.environ.update(SESSION_SQLITE_PATH=os.path.join(directory, 'sessions.db'), SESSION_SWEEP_INTERVAL='0', COMMENT_CACHE_PATH='')
+    os.environ.setdefault('SECRET_KEY', 'benchmark') # so importing app does not append one to .env
+    import app as app_module
+    app = app_module.app
+    store = app.session_interface
+    lifetime = app.permanent_session_lifetime.total_seconds()
+    now = [time.time()]
+    ok = True
+
+    hooks = app.before_request_funcs[None]
+    current = hooks.index(app_module.extend_session_if_active)
+
+    def run(label, previous, threshold):
+        nonlocal ok
+        hooks[current] = previous_extend_session_if_active if previous else app_module.extend_session_if_active
+        app.config['SESSION_REFRESH_EACH_REQUEST'] = previous # Flask's default, which the previous hook ran with
+        app_module.SESSION_REFRESH_AFTER = threshold
+        with mock.patch('time.time', lambda: now[0]):
+            users = [app.test_client() for _ in range(args.clients)]
+            for i, client in enumerate(users):
+                with client.session_transaction() as session: # what /user/google_login leaves behind
+                    session.update(user_id=i + 1, user_name=f"User {i + 1}", user_email=f"user{i + 1}@example.com")
+            anonymous = [app.test_client() for _ in range(args.clients)]
+            before, requests, anonymous_writes = store.writes, 0, 0
+            rounds = int(args.days * 86400 / args.every)
+            for _ in range(rounds):
+                now[0] += args.every
+                for client in users:
+                    ok &= client.get('/api/health').status_code == 200
+                anonymous_before = store.writes
+                for client in anonymous:
+                    ok &= client.get('/api/health').status_code == 200
+                anonymous_writes += store.writes - anonymous_before
+                requests += len(users)
+            writes = store.writes - before - anonymous_writes
+
+            # a session that changes is saved on that request, whatever the threshold
+            before = store.writes
+            users[0].post('/user/fingerprintJS', json={"visitorId": "v-1"})
+            changed = store.writes - before == 1
+            with users[0].session_transaction() as session:
+                changed &= session.get('visitorId') == "v-1"
+            # polling keeps every session alive, and an idle one lives at least (1 - threshold) of the lifetime
+            live = all(client.get('/api/health').get_json()["logged_in"] for client in users)
+            now[0] += lifetime * (1 - threshold) - 60
+            idle = users[-1].get('/api/health').get_json()["logged_in"] # the last client, idle since the live check
+            now[0] += lifetime * threshold + 120
+            expired = not users[0].get('/api/health').get_json()["logged_in"] # another client, idle since the live check as well
+        print(f"{label:<40} {requests} logged-in requests  {writes:6d} session writes  {writes / requests:.4f} per request  "
+              f"{anonymous_writes:6d} writes for as many anonymous requests  changed saved: {changed}  polling sessions live: {live}  idle session live until expiry: {idle and expired}")
+        ok &= changed and live and idle and expired
+        return writes
+
+    previous = run("previous: rewrite on every request", True, 0)
+    for threshold in args.thresholds:
+        writes = run(f"sliding refresh at {threshold:g} of the lifetime", False, threshold)
+        ok &= writes <= args.clients * (args.days / (30 * threshold) + 2) and writes < previous
+    print(f"fewer writes, changes saved at once, sessions slide and expire: {ok}")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,35 @@
+# Startup benchmark: how long `import app` takes (python -X importtime) and how long satya.warm_up() takes after it.
+# To run it (from server/): python -m benchmarks.startup --runs 5
+import subprocess, argparse, statistics, sys
+
+def import_times():
+    """Runs `import app` in a fresh interpreter; returns {module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], capture_output=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def warm_up_time():
+    code = "import time, app; from utils import satya; t = time.perf_counter(); satya.warm_up(); print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    print(f"import app: median {statistics.median(run['app'] for run in runs) / 1000:.0f} ms over {args.runs} runs")
+    last = runs[-1]
+    for name, cumulative in sorted(((n, c) for n, c in last.items() if '.' not in n and n != 'app'), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<30} {cumulative / 1000:8.1f} ms")
+    print(f"satya.warm_up(): {warm_up_time() * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Times satya.sentiment_trend (NumPy bincount) against the previous pandas resample + value_counts + unstack
+# for monthly bins, and checks that both give the same counts.
+# To run it (from server/): python -m benchmarks.trend_aggregation --sizes 500 10000 100000
+from datetime import datetime, timedelta, timezone
+import argparse, random, time
+
+def make_sentiment_data(count, seed=0):
+    """count comments spread over two years, like the records returned by /api/analyze_video."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [{"timestamp": (start + timedelta(seconds=rng.randrange(2 * 365 * 86400))).strftime('%Y-%m-%dT%H:%M:%SZ'),
+             "sentiment": rng.choice((-1, 0, 1))} for _ in range(count)]
+
+def pandas_monthly_counts(sentiment_data):
+    import pandas as pd
+    df = pd.DataFrame(sentiment_data)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df.set_index('timestamp', inplace=True)
+    df['sentiment'] = df['sentiment'].astype(int)
+    return df.resample('ME')['sentiment'].value_counts().unstack(fill_value=0)
+
+def best_of(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 10000, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    from utils import satya
+    try:
+        import pandas # only for the comparison
+    except ImportError:
+        pandas = None
+
+    same = True
+    for size in args.sizes:
+        data = make_sentiment_data(size)
+        line = f"{size:>7} comments"
+        for granularity in ('day', 'week', 'month'):
+            seconds, trend = best_of(lambda: satya.sentiment_trend(data, granularity), args.runs)
+            line += f"  {granularity} {seconds * 1000:7.2f} ms ({len(trend['bins'])} bins)"
+        if pandas is not None:
+            seconds, counts = best_of(lambda: pandas_monthly_counts(data), args.runs)
+            line += f"  | pandas month {seconds * 1000:7.2f} ms"
+            trend = satya.sentiment_trend(data, 'month')
+            same &= all(counts[value].tolist() == trend["counts"][str(value)] for value in (-1, 0, 1))
+        print(line)
+    if pandas is not None:
+        print(f"monthly counts identical to pandas: {same}")
+    return same
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
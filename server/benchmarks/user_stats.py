@@ -0,0 +1,74 @@
+# Counts the SQL statements behind the user statistics of /admin/dashboard and /admin/manage-users and times them:
+# the previous three COUNT queries, the single conditional-aggregate query, and a render served from the stats cache.
+# Also checks that add_new_user, admin_approve_user and admin_disapprove_user invalidate the cache.
+# To run it (from server/): python -m benchmarks.user_stats --users 20000
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import argparse, random, time
+
+statements = []
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+def previous_stats(User):
+    return (User.query.count(), User.query.filter_by(user_status=1).count(), User.query.filter_by(user_status=0).count())
+
+def measure(fn, runs):
+    """(result, SQL statements of one call, best seconds over runs)."""
+    timings = []
+    for _ in range(runs):
+        del statements[:]
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, len(statements), min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--db', default='sqlite:///:memory:', help="SQLAlchemy URL of a scratch database")
+    args = parser.parse_args()
+
+    from utils.database import db, Database, User, user_stats_cache
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.db
+    db.init_app(app)
+    db_obj = Database()
+    rng = random.Random(0)
+    ok = True
+    with app.app_context():
+        db.create_all()
+        db.session.bulk_insert_mappings(User, [{"user_email": f"user{i}@example.com", "user_name": f"user {i}", "user_status": int(rng.random() < 0.3)} for i in range(args.users)])
+        db.session.commit()
+        expected = previous_stats(User)
+
+        def uncached():
+            user_stats_cache.clear()
+            return db_obj.get_user_db_stat()
+
+        for label, fn in (("three COUNT queries", lambda: previous_stats(User)), ("conditional aggregate", uncached), ("stats cache hit", db_obj.get_user_db_stat)):
+            stats, queries, seconds = measure(fn, args.runs)
+            ok &= stats == expected
+            print(f"{label:<22} {queries} queries per render  {seconds * 1e3:8.3f} ms  {stats}")
+
+        # each write must be visible on the next render, at the cost of one query
+        total, approved, not_approved = expected
+        new_user_id = lambda: db_obj.get_user_by_email("new@example.com").user_id
+        writes = [("add_new_user", lambda: db_obj.add_new_user("new@example.com", "new user"), (total + 1, approved, not_approved + 1)),
+                  ("admin_approve_user", lambda: db_obj.admin_approve_user(new_user_id(), 1, "admin@example.com", "admin"), (total + 1, approved + 1, not_approved)),
+                  ("admin_disapprove_user", lambda: db_obj.admin_disapprove_user(new_user_id(), 1, "admin@example.com", "admin"), (total + 1, approved, not_approved + 1))]
+        for write, fn, after in writes:
+            fn()
+            del statements[:]
+            stats = db_obj.get_user_db_stat()
+            ok &= stats == after and len(statements) == 1
+            print(f"after {write:<22} {len(statements)} query  {stats}  (expected {after})")
+    print(f"stats match the COUNT queries and follow every write: {ok}")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
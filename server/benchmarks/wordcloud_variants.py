@@ -0,0 +1,59 @@
+# Compares the word cloud built from a term-frequency table (satya.render_wordcloud) with the previous
+# WordCloud.generate(text) path, and measures render time and response bytes of each size/format variant.
+# To run it (from server/): python -m benchmarks.wordcloud_variants --comments 500
+import argparse, random, time, io
+
+def make_preprocessed_comments(count, vocabulary=3000, seed=0):
+    """Lowercase comments drawn from a Zipf-like vocabulary, like the Processed_Comment text of an analysis."""
+    rng = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'de', 'pa', 'gri', 'sto']
+    words = [''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(vocabulary)]
+    words += [word + 's' for word in words[:200]] # plurals that WordCloud folds into their singular
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return [' '.join(rng.choices(words, weights, k=rng.randint(3, 25))) for _ in range(count)]
+
+def generate_from_text(preprocessed_comments):
+    """The previous path: WordCloud re-tokenizes the joined text."""
+    from wordcloud import WordCloud
+    from utils import satya
+    wordcloud = WordCloud(width=800, height=400, stopwords=satya.wordcloud_stopwords(), **satya.WORDCLOUD_STYLE).generate(' '.join(preprocessed_comments))
+    img_io = io.BytesIO()
+    wordcloud.to_image().save(img_io, format='PNG')
+    return img_io.getvalue()
+
+def best_of(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--comments', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    from wordcloud import WordCloud
+    from utils import satya
+    comments = make_preprocessed_comments(args.comments)
+
+    expected = WordCloud(stopwords=satya.wordcloud_stopwords(), collocations=False).process_text(' '.join(comments))
+    same_frequencies = dict(satya.term_frequencies(comments)) == expected
+    seconds, baseline = best_of(lambda: generate_from_text(comments), args.runs)
+    print(f"generate(text)      full/png   {seconds * 1000:6.0f} ms  {len(baseline):7d} B")
+
+    same_image = False
+    for size in satya.WORDCLOUD_SIZES:
+        for image_format in satya.WORDCLOUD_FORMATS:
+            seconds, image = best_of(lambda: satya.render_wordcloud(comments, size, image_format), args.runs)
+            print(f"from frequencies    {size}/{image_format:<5}{' ' * (9 - len(size))}{seconds * 1000:6.0f} ms  {len(image):7d} B")
+            if (size, image_format) == ('full', 'png'):
+                same_image = image == baseline
+    print(f"frequency table identical to WordCloud.process_text: {same_frequencies}")
+    print(f"full PNG identical to generate(text): {same_image}")
+    return same_frequencies and same_image
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
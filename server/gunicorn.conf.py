@@ -0,0 +1,46 @@
+# Gunicorn settings. To run the server: gunicorn -c gunicorn.conf.py app:app
+# Model serving modes:
+# - default: preload_app loads the model and vectorizer once in the master; forked workers share those pages copy-on-write.
+# - SATYA_INFERENCE_SOCKET=/tmp/satya-inference.sock: the model lives in one inference process (utils/inference.py)
+#   started here, and workers send it micro-batched requests over the Unix socket.
+import subprocess, sys, time, gc, os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', 8000)}"
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+preload_app = True
+
+inference_socket = os.getenv('SATYA_INFERENCE_SOCKET')
+inference_process = None
+
+def on_starting(server):
+    global inference_process
+    from utils import metrics
+    metrics.clear_store() # drop the worker snapshots of the previous run
+    if not inference_socket:
+        return
+    if os.path.exists(inference_socket):
+        os.remove(inference_socket)
+    inference_process = subprocess.Popen([sys.executable, '-m', 'utils.inference', '--socket', inference_socket])
+    deadline = time.time() + 120
+    while not os.path.exists(inference_socket): # wait for the model to load before workers accept traffic
+        if inference_process.poll() is not None or time.time() > deadline:
+            raise RuntimeError("Satya inference server failed to start")
+        time.sleep(0.1)
+    server.log.info(f"Satya inference server ready on {inference_socket}")
+
+def when_ready(server):
+    from utils import satya
+    satya.warm_up() # with preload_app this loads the model, stopwords and WordNet once in the master, before any worker forks
+
+def post_worker_init(worker):
+    from utils import satya
+    satya.warm_up() # no-op if the master already warmed up; otherwise done here, before the worker accepts traffic
+
+def pre_fork(server, worker):
+    gc.freeze() # keep the preloaded objects out of the GC's reach so workers do not copy their pages
+
+def on_exit(server):
+    if inference_process is not None:
+        inference_process.terminate()
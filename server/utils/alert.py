@@ -1,6 +1,7 @@
 from email.message import EmailMessage
 from dotenv import load_dotenv
-import smtplib, os, random
+from utils import metrics
+import smtplib, time, os, random
 load_dotenv()
 
 SENDER_USER = os.getenv("SENDER_USER")
@@ -10,6 +11,20 @@ def generate_otp():
     otp = f"{random.randint(100000, 999999):06d}"
     return otp
 
+def deliver(msg):
+    """Sends a message through Gmail's SMTP server, timing the call for /metrics."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with smtplib.SMTP("smtp.gmail.com", 587) as server:
+            server.starttls()
+            server.login(SENDER_USER, PASSWORD)
+            server.send_message(msg)
+            server.quit()
+        outcome = 'ok'
+    finally:
+        metrics.observe('outbound_request_duration_seconds', time.perf_counter() - start, service='smtp', outcome=outcome)
+
 def send_otp(subject,otp,to_mail):
     # Plain text version (fallback)
     plain_text = f"""Hello,
@@ -100,11 +115,7 @@ TheSoftMax Team
     msg.set_content(plain_text)  # Fallback for non-HTML email clients
     msg.add_alternative(html_text, subtype="html")  # HTML version
 
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(SENDER_USER, PASSWORD)
-        server.send_message(msg)
-        server.quit()
+    deliver(msg)
 
 def new_user_added(email_to:str,email:str,name:str):
     """
@@ -193,11 +204,7 @@ TheSoftMax Team
     msg.set_content(plain_text)  # Fallback for non-HTML email clients
     msg.add_alternative(html_text, subtype="html")  # HTML version
 
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(SENDER_USER, PASSWORD)
-        server.send_message(msg)
-        server.quit()
+    deliver(msg)
 
 if __name__ == '__main__':
     otp = generate_otp()
@@ -0,0 +1,137 @@
+# Compact model artifacts for satya, loaded without unpickling.
+# - lgbm_model.txt: the LightGBM booster in its native text format
+# - vocabulary.npy: the TF-IDF terms (UTF-8) in feature-index order, read into the vectorizer's vocabulary_ dict on load
+# - idf.npy: the IDF weights, memory-mapped
+# - meta.json: the classes and the vectorizer settings
+# To export them from the pickles (from server/): python -m utils.artifacts export
+# To check load time, RSS and prediction parity against the pickles: python -m utils.artifacts verify
+import argparse, subprocess, json, sys, os
+
+ARTIFACT_DIR = os.getenv('SATYA_ARTIFACT_DIR', './models/satya')
+MODEL_PICKLE = './models/lgbm_model.pkl'
+VECTORIZER_PICKLE = './models/tfidf_vectorizer.pkl'
+VECTORIZER_PARAMS = ('lowercase', 'token_pattern', 'ngram_range', 'analyzer', 'norm', 'use_idf', 'smooth_idf', 'sublinear_tf', 'binary', 'strip_accents')
+
+def has_artifacts(artifact_dir=ARTIFACT_DIR):
+    return os.path.exists(os.path.join(artifact_dir, 'meta.json'))
+
+def export(model, vectorizer, artifact_dir=ARTIFACT_DIR):
+    """Writes the model and vectorizer of the pickles in the compact format."""
+    import numpy as np
+    os.makedirs(artifact_dir, exist_ok=True)
+    model.booster_.save_model(os.path.join(artifact_dir, 'lgbm_model.txt'))
+
+    terms = vectorizer.get_feature_names_out()
+    np.save(os.path.join(artifact_dir, 'vocabulary.npy'), np.array([term.encode('utf-8') for term in terms]))
+    np.save(os.path.join(artifact_dir, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float64))
+
+    params = vectorizer.get_params()
+    meta = {
+        "classes": [int(c) for c in model.classes_],
+        "vectorizer": {name: params[name] for name in VECTORIZER_PARAMS},
+    }
+    with open(os.path.join(artifact_dir, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=2)
+
+def read_meta(artifact_dir=ARTIFACT_DIR):
+    with open(os.path.join(artifact_dir, 'meta.json')) as file:
+        return json.load(file)
+
+
+class BoosterModel():
+    """The LightGBM booster with the predict/predict_proba/classes_ interface of the pickled LGBMClassifier."""
+
+    def __init__(self, booster, classes):
+        import numpy as np
+        self.booster_ = booster
+        self.classes_ = np.asarray(classes)
+
+    def predict_proba(self, X):
+        return self.booster_.predict(X)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def load_model(artifact_dir=ARTIFACT_DIR):
+    """Loads the booster from its native text file."""
+    import lightgbm as lgb
+    booster = lgb.Booster(model_file=os.path.join(artifact_dir, 'lgbm_model.txt'))
+    return BoosterModel(booster, read_meta(artifact_dir)["classes"])
+
+def load_vectorizer(artifact_dir=ARTIFACT_DIR):
+    """
+    Rebuilds the fitted TfidfVectorizer from the artifacts. Only idf.npy stays memory-mapped: TfidfVectorizer needs
+    vocabulary_ as a dict, so vocabulary.npy is read once into a per-process dict (shared copy-on-write by the
+    gunicorn workers when preload_app loads it in the master).
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    import numpy as np
+    params = read_meta(artifact_dir)["vectorizer"]
+    params["ngram_range"] = tuple(params["ngram_range"])
+    terms = np.load(os.path.join(artifact_dir, 'vocabulary.npy'), mmap_mode='r')
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term.decode('utf-8'): index for index, term in enumerate(terms)}
+    vectorizer.fixed_vocabulary_ = False
+    vectorizer.idf_ = np.load(os.path.join(artifact_dir, 'idf.npy'), mmap_mode='r')
+    return vectorizer
+
+
+def measure(loader):
+    """Loads with 'pickle' or 'artifacts' in a fresh process; returns (seconds, RSS increase in MB). Linux only (/proc)."""
+    code = f"""
+import time, warnings
+warnings.filterwarnings('ignore')
+import numpy, sklearn.feature_extraction.text, lightgbm, joblib, pickle
+from utils import artifacts
+def rss():
+    return next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS'))
+before = rss()
+start = time.perf_counter()
+if '{loader}' == 'pickle':
+    model = pickle.load(open(artifacts.MODEL_PICKLE, 'rb')); vectorizer = joblib.load(artifacts.VECTORIZER_PICKLE)
+else:
+    model = artifacts.load_model(); vectorizer = artifacts.load_vectorizer()
+elapsed = time.perf_counter() - start
+print(elapsed, (rss() - before) / 1024)
+"""
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    seconds, rss = result.stdout.split()
+    return float(seconds), float(rss)
+
+def verify(comments=2000):
+    """Checks that the artifacts predict exactly like the pickles and compares load time and RSS. Returns True on parity."""
+    import numpy as np, joblib, pickle, random
+    with open(MODEL_PICKLE, 'rb') as file:
+        pickled_model = pickle.load(file)
+    pickled_vectorizer = joblib.load(VECTORIZER_PICKLE)
+    model, vectorizer = load_model(), load_vectorizer()
+
+    rng = random.Random(0)
+    terms = list(pickled_vectorizer.vocabulary_)
+    corpus = [' '.join(rng.choice(terms) for _ in range(rng.randint(1, 20))) for _ in range(comments)]
+    X_pickle, X_artifacts = pickled_vectorizer.transform(corpus), vectorizer.transform(corpus)
+    same_features = (X_pickle != X_artifacts).nnz == 0
+    probs_pickle, probs_artifacts = pickled_model.predict_proba(X_pickle), model.predict_proba(X_artifacts)
+    same_predictions = np.array_equal(pickled_model.predict(X_pickle), model.predict(X_artifacts)) and np.allclose(probs_pickle, probs_artifacts)
+
+    print(f"features identical:    {same_features}")
+    print(f"predictions identical: {same_predictions}")
+    for loader in ('pickle', 'artifacts'):
+        seconds, rss = measure(loader)
+        print(f"{loader:<10} load {seconds * 1000:7.1f} ms   RSS +{rss:.1f} MB")
+    return same_features and same_predictions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or verify the compact satya model artifacts")
+    parser.add_argument('command', choices=['export', 'verify'])
+    parser.add_argument('--out', default=ARTIFACT_DIR)
+    args = parser.parse_args()
+    if args.command == 'export':
+        import joblib, pickle
+        with open(MODEL_PICKLE, 'rb') as file:
+            export(pickle.load(file), joblib.load(VECTORIZER_PICKLE), args.out)
+        print(f"Exported model artifacts to {args.out}")
+    else:
+        sys.exit(0 if verify() else 1)
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import threading, sqlite3, time, json, os
+
+
+class LRUCache():
+    """In-process LRU cache with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] < time.time(): # expired
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key, default=None):
+        """Like get, without counting a hit or miss or refreshing the entry's recency."""
+        with self._lock:
+            entry = self._data.get(key)
+            return default if entry is None or entry[0] < time.time() else entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLiteCache():
+    """
+    On-disk LRU cache in a SQLite (WAL) file, shared by every gunicorn worker on the host.
+    Values are bytes; entries expire after ttl seconds and the least recently used rows are evicted past max_entries.
+    """
+
+    def __init__(self, path, table='cache', max_entries=5000, ttl=600):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = self.misses = self.evictions = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): # one connection per thread, reopened after a fork
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_entry(self, key):
+        """Returns (value, expires_at) for a live entry, or None."""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def size(self, key):
+        """Length in bytes of key's live value (None if there is none), without reading it or counting a hit or miss."""
+        row = self._connect().execute(f"SELECT length(value) FROM {self.table} WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def expires_at(self, key):
+        """The expiry of key's entry (None if there is none), without counting a hit or miss. Every set changes it."""
+        row = self._connect().execute(f"SELECT expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value, ttl=None):
+        """Stores value; returns its expiry."""
+        conn = self._connect()
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                     (key, value, expires_at, now))
+        cursor = conn.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.evictions += max(cursor.rowcount, 0)
+        return expires_at
+
+    def delete(self, key):
+        self._connect().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def stats(self):
+        entries = self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class TieredCache():
+    """
+    Two-tier cache: an in-process LRUCache in front of an optional SQLiteCache.
+    dumps/loads convert values to and from the bytes stored on disk.
+    With shared=True the values are state that any worker may rewrite: a memory hit is only served while the disk
+    entry still has the expiry it was read or written with, so a newer value from another worker is never hidden.
+    """
+
+    def __init__(self, memory, disk=None, dumps=None, loads=None, shared=False):
+        self.memory = memory
+        self.disk = disk
+        self.shared = shared and disk is not None
+        self.dumps = dumps or (lambda value: json.dumps(value, separators=(',', ':')).encode())
+        self.loads = loads or json.loads
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if self.shared and value is not None:
+            value, expires_at = value
+            if self.disk.expires_at(key) != expires_at: # rewritten or deleted by another worker since
+                value = None
+        if value is not None or self.disk is None:
+            return value
+        entry = self.disk.get_entry(key)
+        if entry is None:
+            return None
+        value = self.loads(entry[0])
+        self.memory.set(key, (value, entry[1]) if self.shared else value, ttl=entry[1] - time.time()) # promote, keeping the disk expiry
+        return value
+
+    def size(self, key):
+        """Stored size in bytes of key's value (None if absent), without counting a hit or miss."""
+        if self.disk is not None:
+            return self.disk.size(key)
+        value = self.memory.peek(key)
+        return None if value is None else len(self.dumps(value))
+
+    def set(self, key, value):
+        if self.disk is None:
+            self.memory.set(key, value)
+            return
+        expires_at = self.disk.set(key, self.dumps(value))
+        self.memory.set(key, (value, expires_at) if self.shared else value)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self):
+        memory = self.memory.stats()
+        disk = self.disk.stats() if self.disk is not None else None
+        return {"hits": memory["hits"] + (disk["hits"] if disk else 0),
+                "misses": disk["misses"] if disk else memory["misses"],
+                "evictions": memory["evictions"] + (disk["evictions"] if disk else 0),
+                "memory": memory, "disk": disk}
+
+
+def tiered_cache_from_env(prefix, table, ttl=600, size=128, disk_size=5000, dumps=None, loads=None, shared=False):
+    """
+    Builds a TieredCache configured by the {prefix}_TTL, {prefix}_SIZE (memory entries), {prefix}_DISK_SIZE
+    and {prefix}_PATH (SQLite file, empty disables the disk tier) environment variables.
+    """
+    ttl = int(os.getenv(f'{prefix}_TTL', ttl))
+    memory = LRUCache(max_entries=int(os.getenv(f'{prefix}_SIZE', size)), ttl=ttl)
+    disk_path = os.getenv(f'{prefix}_PATH', './cache/satya_cache.db')
+    disk = SQLiteCache(disk_path, table=table, max_entries=int(os.getenv(f'{prefix}_DISK_SIZE', disk_size)), ttl=ttl) if disk_path else None
+    return TieredCache(memory, disk, dumps=dumps, loads=loads, shared=shared)
+
+def comment_cache_from_env():
+    """Builds the YouTube comment cache (keyed by video_id) from COMMENT_CACHE_* environment variables."""
+    return tiered_cache_from_env('COMMENT_CACHE', 'comments')
+
+def analysis_state_from_env():
+    """
+    Builds the per-video incremental analysis state store (keyed by video_id) from ANALYSIS_STATE_* environment variables.
+    It is state rather than a cache, so memory hits are checked against the SQLite tier (shared=True): charts served by
+    one worker always come from the analysis another worker just stored.
+    """
+    return tiered_cache_from_env('ANALYSIS_STATE', 'analysis_state', ttl=7 * 24 * 3600, size=64, disk_size=2000, shared=True)
+
+def render_cache_from_env():
+    """Builds the rendered chart cache (PNG bytes keyed by content hash) from RENDER_CACHE_* environment variables."""
+    return tiered_cache_from_env('RENDER_CACHE', 'renders', ttl=24 * 3600, size=64, disk_size=1000, dumps=bytes, loads=bytes)
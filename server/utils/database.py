@@ -1,10 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, case, event, insert, select, update, or_
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import aliased
 from datetime import datetime, timezone
 from utils.alert import new_user_added
+from utils.cache import LRUCache
+from collections import namedtuple
 from decimal import Decimal
 from enum import Enum
+import os, re
 
 db = SQLAlchemy()
+# (total, approved, not approved) user counts shown on the admin pages; cleared by this process's own writes to
+# user_status, other workers pick them up within USER_STATS_TTL seconds
+user_stats_cache = LRUCache(max_entries=1, ttl=int(os.getenv('USER_STATS_TTL', 30)))
+# read-only snapshots of recently seen users by user_id; cleared by this process's writes to a user, other workers
+# pick those up within USER_CACHE_TTL seconds (credit debits and device checks never read it, see debit_user_credits)
+user_row_cache = LRUCache(max_entries=int(os.getenv('USER_CACHE_SIZE', 1024)), ttl=int(os.getenv('USER_CACHE_TTL', 10)))
+SEARCH_PAGE_SIZE = 50 # users per page of /admin/manage-users
+SEARCH_MAX_PAGE_SIZE = 200
+SEARCH_WORD_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 20 # longer words are indexed (and searched) by their first 20 characters
+MAX_USER_ID = 2**31 - 1 # largest value of the INT user_id column
 
 class User(db.Model):
     __tablename__ = "user"
@@ -21,6 +38,60 @@ class User(db.Model):
     def __repr__(self):
         return f'User("{self.user_id}","{self.user_email}","{self.user_name}","{self.user_status}")'
 
+UserRow = namedtuple('UserRow', ['user_id', 'user_email', 'user_name', 'user_status', 'user_credits', 'device_id'])
+
+class UserSearchToken(db.Model):
+    """
+    Name search index: one row per (prefix of a word in the user's name or email local part, user),
+    plus one row for the email domain with its @ ("@gmail.com"), which no word search can collide with.
+    A search word is an equality lookup on the primary key, which also keeps the matches in user_id order for keyset pages.
+    Rows are rewritten by the User mapper events below whenever a user is inserted or renamed.
+    """
+    __tablename__ = "user_search_token"
+    # binary collation on MySQL, so that prefixes differing only by accents ("jose", "josé") are separate keys
+    token = db.Column(db.String(MAX_TOKEN_LENGTH).with_variant(mysql.VARCHAR(MAX_TOKEN_LENGTH, collation='utf8mb4_bin'), 'mysql'), primary_key=True, comment="Lowercase word prefix")
+    user_id = db.Column(db.Integer, db.ForeignKey("user.user_id", ondelete="CASCADE"), primary_key=True, index=True)
+
+def search_tokens(user_name, user_email):
+    """
+    Every prefix (up to MAX_TOKEN_LENGTH characters) of every word in the name and the part of the email before the @,
+    and the email domain with its @ (its first MAX_TOKEN_LENGTH characters).
+    """
+    local, _, domain = (user_email or '').lower().partition('@')
+    tokens = set()
+    for word in SEARCH_WORD_RE.findall(f"{user_name or ''} {local}".lower()):
+        tokens.update(word[:length] for length in range(1, min(len(word), MAX_TOKEN_LENGTH) + 1))
+    if domain:
+        tokens.add(f"@{domain}"[:MAX_TOKEN_LENGTH])
+    return tokens
+
+search_index_ready = False
+
+def search_index_exists(connection):
+    """
+    Whether the user_search_token table exists. It is created by db.create_all() or `flask --app app reindex-user-search`,
+    not by a plain gunicorn start, so until then user writes skip the index and searches fall back to LIKE.
+    Checked on each call until the table is found, then remembered for the process.
+    """
+    global search_index_ready
+    if not search_index_ready:
+        search_index_ready = db.inspect(connection).has_table(UserSearchToken.__tablename__)
+    return search_index_ready
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def index_user_search_tokens(mapper, connection, user):
+    state = db.inspect(user)
+    if not state.attrs.user_name.history.has_changes() and not state.attrs.user_email.history.has_changes():
+        return # e.g. a credit or status update
+    if not search_index_exists(connection):
+        return # reindex-user-search indexes this user along with the others
+    table = UserSearchToken.__table__
+    connection.execute(table.delete().where(table.c.user_id == user.user_id))
+    rows = [{"token": token, "user_id": user.user_id} for token in search_tokens(user.user_name, user.user_email)]
+    if rows: # a name and email without any word characters has no tokens
+        connection.execute(insert(table), rows)
+
 class Admin(db.Model):
     __tablename__ = "admin"
     admin_id=db.Column(db.Integer, primary_key=True)
@@ -102,6 +173,7 @@ class Database():
         if user:
             user.device_id = device_id
             db.session.commit()
+            user_row_cache.delete(user_id)
             return user
         return None
     
@@ -127,6 +199,17 @@ class Database():
                 return True
         return False
 
+    def get_user_row(self, user_id):
+        """A UserRow snapshot of the user, from user_row_cache if it was read in the last USER_CACHE_TTL seconds; None if there is no such user."""
+        row = user_row_cache.get(user_id)
+        if row is None:
+            row = db.session.execute(select(*(getattr(User, field) for field in UserRow._fields)).where(User.user_id == user_id)).first()
+            if row is None:
+                return None
+            row = UserRow(*row)
+            user_row_cache.set(user_id, row)
+        return row
+
     def get_user_by_email(self, user_email):
         user = User.query.filter_by(user_email=user_email).first() # db.session.get(User, email)
         if user:
@@ -134,20 +217,99 @@ class Database():
         else:
             return None
         
-    def search_users_by_name_or_email_or_id(self, search_term):
-        users = User.query.filter(User.user_name.ilike('%'+search_term+'%')).all() # Use ilike() for case-insensitive search.
-        return users
+    def search_users_by_name_or_email_or_id(self, search_term='', after=None, limit=SEARCH_PAGE_SIZE):
+        """
+        Returns (users, next_after): one page of users matching search_term, and the cursor of the next page (None on the last page).
+        Every kind of search reads an index range and stops after the page, however many users there are:
+        - no term: all users by user_id
+        - digits: the user with that ID
+        - a term starting with @: users at that email domain (the whole domain, e.g. "@gmail.com"), by user_id
+        - any other term with an @: users whose email starts with it, by email
+        - otherwise: users with, for every word of the term, a word in their name or email starting with it, by user_id
+        after is the next_after of the previous page.
+        """
+        search_term = (search_term or '').strip().lower()
+        limit = max(1, min(int(limit), SEARCH_MAX_PAGE_SIZE))
+        if search_term.isdecimal():
+            user_id = int(search_term)
+            user = db.session.get(User, user_id) if user_id <= MAX_USER_ID else None # larger IDs cannot exist (and overflow SQLite)
+            return ([user] if user and after is None else []), None
+
+        if '@' in search_term and not search_term.startswith('@'):
+            # the range [term, term with its last character incremented) is the set of emails starting with term, on the unique email index
+            query = User.query.filter(User.user_email >= search_term, User.user_email < search_term[:-1] + chr(ord(search_term[-1]) + 1))
+            if after is not None:
+                query = query.filter(User.user_email > after)
+            users = query.order_by(User.user_email).limit(limit + 1).all()
+            return users[:limit], (users[limit - 1].user_email if len(users) > limit else None)
+
+        try:
+            after = int(after) if after is not None else None
+        except ValueError: # a cursor from another kind of search
+            after = None
+        if search_term.startswith('@'):
+            words = [search_term[:MAX_TOKEN_LENGTH]]
+        else:
+            words = sorted({word[:MAX_TOKEN_LENGTH] for word in SEARCH_WORD_RE.findall(search_term)}, key=len, reverse=True)
+        if not search_term:
+            query = User.query
+            key = User.user_id
+        elif not words:
+            return [], None
+        elif not search_index_exists(db.session.connection()): # not created yet: scan, until reindex-user-search is run
+            if search_term.startswith('@'):
+                query = User.query.filter(User.user_email.like(f"%{search_term}"))
+            else:
+                query = User.query.filter(*[or_(User.user_name.ilike(f"%{word}%"), User.user_email.ilike(f"{word}%")) for word in words])
+            key = User.user_id
+        else:
+            # the longest word is usually the most selective, so its postings drive the scan; the others are primary key probes
+            query = User.query.join(UserSearchToken, UserSearchToken.user_id == User.user_id).filter(UserSearchToken.token == words[0])
+            for word in words[1:]:
+                other = aliased(UserSearchToken)
+                query = query.filter(db.session.query(other).filter(other.token == word, other.user_id == UserSearchToken.user_id).exists())
+            key = UserSearchToken.user_id
+        if after is not None:
+            query = query.filter(key > after)
+        users = query.order_by(key).limit(limit + 1).all()
+        return users[:limit], (users[limit - 1].user_id if len(users) > limit else None)
+
+    def reindex_user_search(self, batch_size=1000):
+        """Rebuilds user_search_token from every user (for users added before the index existed, or by bulk inserts). Returns the number of users."""
+        table = UserSearchToken.__table__
+        db.session.execute(table.delete())
+        count, after = 0, 0
+        while True:
+            users = User.query.with_entities(User.user_id, User.user_name, User.user_email).filter(User.user_id > after).order_by(User.user_id).limit(batch_size).all()
+            if not users:
+                break
+            rows = [{"token": token, "user_id": user.user_id} for user in users for token in search_tokens(user.user_name, user.user_email)]
+            if rows:
+                db.session.execute(insert(table), rows)
+            db.session.commit()
+            count, after = count + len(users), users[-1].user_id
+        db.session.commit()
+        return count
     
     def get_all_users(self):
         return User.query.all()
     
     def get_user_db_stat(self):
-        return (User.query.count(), User.query.filter_by(user_status=1).count(), User.query.filter_by(user_status=0).count())
+        stats = user_stats_cache.get('users')
+        if stats is None:
+            # one pass over the table with conditional sums instead of three COUNT queries
+            total, approved, not_approved = db.session.query(func.count(User.user_id),
+                                                             func.sum(case((User.user_status == 1, 1), else_=0)),
+                                                             func.sum(case((User.user_status == 0, 1), else_=0))).one()
+            stats = (total, int(approved or 0), int(not_approved or 0)) # SUM is NULL on an empty table and a Decimal on MySQL
+            user_stats_cache.set('users', stats)
+        return stats
         
     def add_new_user(self, user_email, user_name, user_status=0):
         new_user = User(user_email=user_email, user_name=user_name, user_status=user_status)
         db.session.add(new_user)
         db.session.commit()
+        user_stats_cache.clear()
         return new_user
     
     def add_new_admin(self, admin_name, admin_email, hashed_password):
@@ -184,6 +346,8 @@ class Database():
         if user:
             user.user_status = 1
             db.session.commit()
+            user_stats_cache.clear()
+            user_row_cache.delete(user_id)
             return user
         return None
     
@@ -192,6 +356,8 @@ class Database():
         if user:
             user.user_status = 0
             db.session.commit()
+            user_stats_cache.clear()
+            user_row_cache.delete(user_id)
             return user
         return None
 
@@ -259,6 +425,7 @@ class Database():
                 payment.paid_at=datetime.now(timezone.utc)
                 user.user_credits = user.user_credits + (payment.amount / 100)
                 db.session.commit()
+                user_row_cache.delete(user_id)
                 return True
             else:
                 return False
@@ -266,12 +433,37 @@ class Database():
             return False
 
     def update_user_credits(self, user_id, amount = 1, service_name = 'SATYA'):
-        user = User.query.filter_by(user_id=user_id).first()
-        if user:
-            user.user_credits -= Decimal(str(amount))
-            db.session.commit()
-            return True
-        return False
+        # single atomic UPDATE, so concurrent debits (e.g. a batch of videos) cannot overwrite each other
+        updated = User.query.filter_by(user_id=user_id).update({User.user_credits: User.user_credits - Decimal(str(amount))}, synchronize_session=False)
+        db.session.commit()
+        user_row_cache.delete(user_id)
+        return updated > 0
+
+    def debit_user_credits(self, user_id, device_id, amount = 1, service_name = 'SATYA'):
+        """
+        Checks the device and the balance and debits amount credits in one conditional UPDATE, so concurrent requests
+        can neither lose a debit nor overdraw. Returns (new balance, None), or (None, 'unknown device' or 'insufficient credits').
+        """
+        amount = Decimal(str(amount))
+        statement = (update(User).where(User.user_id == user_id, User.device_id == device_id, User.user_credits >= amount)
+                     .values(user_credits=User.user_credits - amount).execution_options(synchronize_session=False))
+        if db.engine.dialect.update_returning: # SQLite 3.35+, PostgreSQL: the new balance comes back with the UPDATE
+            balance = db.session.execute(statement.returning(User.user_credits)).scalar()
+        elif db.session.execute(statement).rowcount:
+            # MySQL has no RETURNING; the UPDATE holds the row lock until the commit, so this reads our own debit
+            balance = db.session.execute(select(User.user_credits).where(User.user_id == user_id)).scalar()
+        else:
+            balance = None
+        db.session.commit()
+        if balance is not None:
+            user_row_cache.delete(user_id)
+            return balance, None
+        device = db.session.execute(select(User.device_id).where(User.user_id == user_id)).scalar() # only when rejected, to say why
+        return None, ('insufficient credits' if device is not None and device == device_id else 'unknown device')
+
+    def refund_user_credits(self, user_id, amount = 1, service_name = 'SATYA'):
+        # gives back credits debited for an analysis that failed
+        return self.update_user_credits(user_id, amount=-amount, service_name=service_name)
 
 if __name__ == "__main__":
 
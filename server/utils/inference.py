@@ -0,0 +1,153 @@
+# Local inference process shared by all gunicorn workers.
+# The model and vectorizer are loaded once here instead of once per worker; workers send
+# preprocessed comments over a Unix socket and requests from different workers are micro-batched together.
+# To run it on its own (from server/): python -m utils.inference --socket /tmp/satya-inference.sock
+# gunicorn.conf.py starts it automatically when SATYA_INFERENCE_SOCKET is set.
+from concurrent.futures import Future
+import socketserver, threading, argparse, socket, struct, queue, json, time, os
+
+HEADER = struct.Struct('!I') # 4-byte big-endian length prefix for each JSON message
+MAX_BATCH_ROWS = int(os.getenv('INFERENCE_MAX_BATCH_ROWS', 2000))
+BATCH_WAIT = float(os.getenv('INFERENCE_BATCH_WAIT_MS', 5)) / 1000 # how long to wait for other workers' requests to join a batch
+
+def send_message(sock, message):
+    payload = json.dumps(message, separators=(',', ':')).encode()
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Inference socket closed")
+        data += chunk
+    return bytes(data)
+
+def recv_message(sock):
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return json.loads(recv_exactly(sock, size))
+
+
+class MicroBatcher():
+    """Collects prediction requests from many connections and runs them through the model as one batch."""
+
+    def __init__(self, predict, max_rows=MAX_BATCH_ROWS, wait=BATCH_WAIT):
+        self.predict = predict # list of preprocessed comments -> (predictions, confidence_scores)
+        self.max_rows = max_rows
+        self.wait = wait
+        self.requests = queue.Queue()
+        self.batches = self.rows = 0
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, comments):
+        future = Future()
+        self.requests.put((comments, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()] # block until the first request
+            rows = len(batch[0][0])
+            deadline = time.monotonic() + self.wait
+            while rows < self.max_rows:
+                try:
+                    item = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            comments = [comment for item, _ in batch for comment in item]
+            try:
+                predictions, confidence_scores = self.predict(comments)
+                predictions, confidence_scores = [int(p) for p in predictions], [float(c) for c in confidence_scores]
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += rows
+
+            offset = 0
+            for item, future in batch:
+                future.set_result((predictions[offset:offset + len(item)], confidence_scores[offset:offset + len(item)]))
+                offset += len(item)
+
+
+def serve(socket_path):
+    """Loads the model once and serves predictions on a Unix socket until the process is stopped."""
+    os.environ.pop('SATYA_INFERENCE_SOCKET', None) # this process predicts locally
+    from utils import satya
+    satya.warm_up() # loads the model and vectorizer in this process only
+
+    def predict(comments):
+        return satya.predict_sentiment(satya.vectorizer.transform(comments))
+
+    batcher = MicroBatcher(predict)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True: # one persistent connection per worker thread
+                try:
+                    message = recv_message(self.request)
+                except ConnectionError:
+                    return
+                try:
+                    predictions, confidence_scores = batcher.submit(message['comments'])
+                    send_message(self.request, {"predictions": predictions, "confidence": confidence_scores})
+                except Exception as e:
+                    send_message(self.request, {"error": str(e)})
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"Satya inference server listening on {socket_path}")
+    server.serve_forever()
+
+
+class InferenceClient():
+    """Sends preprocessed comments to the inference process; one persistent connection per thread."""
+
+    def __init__(self, socket_path, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or self._local.pid != os.getpid(): # reconnect after a fork
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock, self._local.pid = sock, os.getpid()
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def predict(self, comments):
+        """Returns (predictions, confidence_scores) for a list of preprocessed comments."""
+        for attempt in range(2): # retry once on a stale connection (e.g. the inference process restarted)
+            try:
+                sock = self._connect()
+                send_message(sock, {"comments": comments})
+                response = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+        if 'error' in response:
+            raise RuntimeError(f"Inference server error: {response['error']}")
+        return response['predictions'], response['confidence']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Satya inference server")
+    parser.add_argument('--socket', default=os.getenv('SATYA_INFERENCE_SOCKET', '/tmp/satya-inference.sock'))
+    args = parser.parse_args()
+    serve(args.socket)
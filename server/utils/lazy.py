@@ -0,0 +1,16 @@
+import importlib
+
+class LazyModule():
+    """
+    Stand-in for a module that is imported on first attribute access.
+    Keeps heavy libraries (pandas, matplotlib, nltk, ...) off the startup path until a request needs them.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name) # the import lock makes this thread-safe
+        return getattr(self._module, attr)
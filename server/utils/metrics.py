@@ -0,0 +1,209 @@
+# Counters and latency histograms for the app, exposed in the Prometheus text format on /metrics.
+# Each process (gunicorn worker, the master during warm-up) keeps its own registry and writes a snapshot to
+# METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds; /metrics sums the snapshots of all processes.
+# Counters of exited workers are kept, so totals never go backwards; gunicorn.conf.py clears the directory on start.
+from contextlib import ContextDecorator
+import threading, time, json, glob, os
+
+METRICS_DIR = os.getenv('METRICS_DIR', './cache/metrics')
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERIES = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+METRICS = { # name -> (type, help, histogram buckets)
+    'http_request_duration_seconds': ('histogram', "Flask request latency by route, method and status.", SECONDS),
+    'satya_stage_duration_seconds': ('histogram', "Time spent in each stage of the satya analysis pipeline.", SECONDS),
+    'satya_render_duration_seconds': ('histogram', "Chart render time by chart.", SECONDS),
+    'db_queries_per_request': ('histogram', "SQL statements executed per request, by route.", QUERIES),
+    'db_query_duration_seconds': ('histogram', "SQL statement execution time.", SECONDS),
+    'outbound_request_duration_seconds': ('histogram', "Outbound HTTP and SMTP call duration by service and outcome.", SECONDS),
+    'db_queries_total': ('counter', "SQL statements executed.", None),
+}
+
+
+class Registry():
+    """Counters and histograms of this process, keyed by metric name and a sorted tuple of label pairs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {} # key -> [count per bucket..., count in +Inf, sum]
+        self._pid = os.getpid()
+        self._flusher = None
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self): # a forked worker starts empty instead of re-reporting what the master recorded
+        self._lock = threading.Lock()
+        self.counters, self.histograms = {}, {}
+        self._pid, self._flusher = os.getpid(), None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._ensure_flusher()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            counts = self.histograms.get(key)
+            if counts is None:
+                counts = self.histograms[key] = [0] * (len(buckets) + 2)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            counts[index] += 1
+            counts[-1] += value
+        self._ensure_flusher()
+
+    def snapshot(self):
+        with self._lock:
+            return {"counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                    "histograms": [[name, dict(labels), list(counts)] for (name, labels), counts in self.histograms.items()]}
+
+    def flush(self, directory=METRICS_DIR):
+        """Writes this process's snapshot to directory/<pid>.json (atomically, so readers never see half a file)."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path + '.tmp', path)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or not FLUSH_INTERVAL:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, daemon=True)
+        self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing metrics: {e}")
+
+registry = Registry()
+
+
+class timer(ContextDecorator):
+    """Observes the elapsed seconds of a with-block or decorated function into a histogram."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def _recreate_cm(self): # a fresh timer per call of a decorated function, so concurrent calls don't share start times
+        return timer(self.name, **self.labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def clear_store(directory=METRICS_DIR):
+    """Removes the snapshots of earlier runs (called by gunicorn.conf.py when the server starts)."""
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+def collect(directory=METRICS_DIR):
+    """Sums the snapshots of every process; the calling process's own registry is flushed first so it is current."""
+    registry.flush(directory)
+    counters, histograms = {}, {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError): # removed or replaced while reading
+            continue
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts in snapshot["histograms"]:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+    return counters, histograms
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def exposition(directory=METRICS_DIR):
+    """All metrics of all processes in the Prometheus text exposition format (version 0.0.4)."""
+    counters, histograms = collect(directory)
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        series = sorted((key for key in (histograms if kind == 'histogram' else counters) if key[0] == name), key=lambda key: key[1])
+        if not series:
+            continue
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for key in series:
+            labels = key[1]
+            if kind == 'counter':
+                lines.append(f"{name}{format_labels(labels)} {counters[key]}")
+                continue
+            counts = histograms[key]
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}")
+            cumulative += counts[len(buckets)]
+            lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {counts[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Times every request by route and counts its SQL statements through SQLAlchemy's engine events."""
+    from flask import g, request, has_request_context
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.db_queries = 0
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe('http_request_duration_seconds', time.perf_counter() - start, route=route, method=request.method, status=response.status_code)
+            observe('db_queries_per_request', g.pop('db_queries', 0), route=route)
+        return response
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'handle_error')
+    def drop_query_timer(context): # a failed statement never reaches after_cursor_execute
+        starts = context.connection.info.get('metrics_query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        observe('db_query_duration_seconds', time.perf_counter() - conn.info['metrics_query_start'].pop())
+        inc('db_queries_total')
+        if has_request_context() and 'db_queries' in g:
+            g.db_queries += 1
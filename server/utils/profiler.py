@@ -0,0 +1,151 @@
+# Opt-in profiling of single requests, for finding where the time of one slow call goes in production.
+# A request is profiled when it carries "X-Profile: 1" from an admin session (or "X-Profile: $PROFILE_TOKEN"),
+# or when it is picked by PROFILE_SAMPLE_RATE (a fraction of all requests, 0 by default).
+# A profile holds the cProfile stats of the request and every SQL statement it issued with its duration. The newest
+# PROFILE_KEEP profiles are kept as files in PROFILE_DIR, so every gunicorn worker sees the same list.
+# When no request is being profiled, nothing is hooked: the SQLAlchemy listeners are only attached while one is.
+from flask import g, request, session, has_request_context
+import threading, cProfile, pstats, random, hmac, time, json, glob, io, os, re
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', './cache/profiles')
+SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+KEEP = int(os.getenv('PROFILE_KEEP', 20))
+ENVIRON_KEY = 'HTTP_X_PROFILE'
+TOP_FUNCTIONS = 40 # lines of the cumulative-time table stored in the summary
+PROFILE_ID = re.compile(r'^[0-9]+-[0-9]+-[0-9]+$')
+
+_listening = 0 # requests being profiled in this process
+_lock = threading.Lock()
+_counter = iter(range(1, 1 << 62))
+
+def wants_profile():
+    """Why the current request should be profiled ('requested' or 'sampled'), or None."""
+    value = request.environ.get(ENVIRON_KEY) # cheaper than request.headers on the path taken by every request
+    if value:
+        token = os.getenv('PROFILE_TOKEN')
+        if session.get('admin_id') or (token and hmac.compare_digest(value.encode(), token.encode())):
+            return 'requested'
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+def _drop_query(context): # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get('profile_query_start') if context.connection is not None else None
+    if starts and has_request_context() and 'profile' in g:
+        g.profile["sql"].append({"statement": context.statement, "seconds": time.perf_counter() - starts.pop(), "error": str(context.original_exception)})
+
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('profile_query_start')
+    if starts and has_request_context() and 'profile' in g:
+        g.profile["sql"].append({"statement": statement, "seconds": time.perf_counter() - starts.pop(), "executemany": executemany})
+
+def _listen(attach):
+    """Attaches the SQL listeners when the first profiled request starts and removes them after the last one ends."""
+    global _listening
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    with _lock:
+        _listening += 1 if attach else -1
+        if _listening != (1 if attach else 0):
+            return
+        for name, fn in (('before_cursor_execute', _start_query), ('after_cursor_execute', _end_query), ('handle_error', _drop_query)):
+            (event.listen if attach else event.remove)(Engine, name, fn)
+
+def start(reason):
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError: # another profiler is already active on this thread
+        return
+    _listen(True)
+    g.profile = {"profiler": profile, "start": time.perf_counter(), "reason": reason, "sql": []}
+
+def finish(response):
+    """Stops the profile of this request, stores it and names it in the X-Profile-Id response header."""
+    state = g.pop('profile')
+    state["profiler"].disable()
+    seconds = time.perf_counter() - state["start"]
+    _listen(False)
+    profile_id = f"{int(time.time() * 1000)}-{os.getpid()}-{next(_counter)}"
+    stats = pstats.Stats(state["profiler"], stream=io.StringIO())
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    summary = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.path,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "status": response.status_code,
+        "seconds": seconds,
+        "started": time.time() - seconds,
+        "reason": state["reason"],
+        "sql_count": len(state["sql"]),
+        "sql_seconds": sum(query["seconds"] for query in state["sql"]),
+        "sql": state["sql"],
+        "top_functions": stats.stream.getvalue(),
+    }
+    try:
+        save(profile_id, summary, stats)
+        response.headers['X-Profile-Id'] = profile_id
+    except OSError as e:
+        print(f"Error saving profile: {e}")
+    return response
+
+def save(profile_id, summary, stats, directory=PROFILE_DIR):
+    """Writes <id>.json (summary and SQL) and <id>.prof (pstats, for snakeviz or pstats.Stats), then keeps the newest KEEP."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile_id)
+    stats.dump_stats(path + '.prof')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(summary, file)
+    os.replace(path + '.tmp', path + '.json') # the summary is written last, so a listed profile is complete
+    for old in sorted(glob.glob(os.path.join(directory, '*.json')), key=os.path.getmtime)[:-KEEP or None]:
+        for stale in (old, old[:-len('.json')] + '.prof'):
+            try:
+                os.remove(stale)
+            except OSError: # already pruned by another worker
+                pass
+
+def list_profiles(directory=PROFILE_DIR):
+    """Summaries of the stored profiles, newest first, without the SQL statements and function table."""
+    profiles = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                summary = json.load(file)
+        except (OSError, ValueError): # pruned while reading
+            continue
+        profiles.append({key: value for key, value in summary.items() if key not in ('sql', 'top_functions')})
+    return sorted(profiles, key=lambda summary: summary["started"], reverse=True)
+
+def profile_path(profile_id, extension, directory=PROFILE_DIR):
+    """The file of a stored profile, or None if the id is malformed or the profile was pruned."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(directory, f"{profile_id}.{extension}")
+    return path if os.path.exists(path) else None
+
+def init_app(app):
+    """Profiles the requests picked by wants_profile() from before_request to after_request."""
+
+    @app.before_request
+    def start_profile():
+        reason = wants_profile()
+        if reason:
+            start(reason)
+
+    @app.after_request
+    def finish_profile(response):
+        if 'profile' in g:
+            return finish(response)
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc): # an unhandled exception skips after_request
+        state = g.pop('profile', None)
+        if state is not None:
+            state["profiler"].disable()
+            _listen(False)
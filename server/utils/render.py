@@ -0,0 +1,36 @@
+# Bounded worker pool for chart rendering.
+# Renders run on a fixed number of threads; at most queue_depth more wait behind them. Past that, submit()
+# raises RenderQueueFull right away so a burst of chart requests gets a quick 503 instead of piling up behind slow renders.
+from concurrent.futures import ThreadPoolExecutor
+import threading, os
+
+RENDER_THREADS = int(os.getenv('SATYA_RENDER_THREADS', 4))
+RENDER_QUEUE_DEPTH = int(os.getenv('SATYA_RENDER_QUEUE_DEPTH', 32))
+
+class RenderQueueFull(Exception):
+    """Raised when every render thread is busy and the render queue is full."""
+
+
+class RenderPool():
+    """ThreadPoolExecutor with a limit on the renders waiting for a thread."""
+
+    def __init__(self, threads=RENDER_THREADS, queue_depth=RENDER_QUEUE_DEPTH):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='render')
+        self.slots = threading.BoundedSemaphore(threads + queue_depth) # running + waiting renders
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            raise RenderQueueFull("Too many charts are being rendered. Please try again shortly.")
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """Renders on the pool and waits for the result."""
+        return self.submit(fn, *args).result()
@@ -1,51 +1,96 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from flask import app, jsonify, send_file
-from mlflow.tracking import MlflowClient
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords
-import matplotlib.dates as mdates
-import mlflow, joblib, io, re, os, requests
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
+from flask import current_app, jsonify, send_file, Response
 from dotenv import load_dotenv
-import pandas as pd
-import numpy as np
-import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import Counter
+from utils.cache import comment_cache_from_env, analysis_state_from_env, render_cache_from_env
+from utils.inference import InferenceClient
+from utils.lazy import LazyModule
+from utils.render import RenderPool, RenderQueueFull
+from utils import artifacts, metrics
+from utils import youtube
+import threading, hashlib, pickle, base64, json, io, re, os
 
 load_dotenv()
-YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
+os.environ.setdefault('MPLBACKEND', 'Agg') # non-interactive matplotlib backend, for libraries that import pyplot (wordcloud's colormaps)
+
+# Heavy libraries are imported on first use (or by warm_up), not when the app starts
+np = LazyModule('numpy')
+mfigure = LazyModule('matplotlib.figure')
+magg = LazyModule('matplotlib.backends.backend_agg')
+mdates = LazyModule('matplotlib.dates')
+
+# Preprocessing state is built once by load_preprocessing() and shared by every request.
+STOP_WORDS = None
+NON_ALPHANUMERIC_RE = re.compile(r'[^A-Za-z0-9\s!?.,]')
+LEMMA_CACHE_SIZE = int(os.getenv('SATYA_LEMMA_CACHE_SIZE', 100000))
+lemmatizer = None
+load_lock = threading.Lock()
+
+MAX_BATCH_VIDEOS = int(os.getenv('SATYA_MAX_BATCH_VIDEOS', 20))
+STAGE_METRIC = 'satya_stage_duration_seconds'
+BATCH_FETCH_CONCURRENCY = int(os.getenv('SATYA_BATCH_FETCH_CONCURRENCY', 4)) # videos fetched at the same time by /api/analyze_videos
+render_pool = RenderPool() # every chart render runs here, SATYA_RENDER_THREADS at a time
+
+def load_preprocessing():
+    """Loads the NLTK stopwords and the WordNet lemmatizer once."""
+    global STOP_WORDS, lemmatizer
+    if STOP_WORDS is not None:
+        return
+    with load_lock:
+        if STOP_WORDS is None:
+            from nltk.stem import WordNetLemmatizer
+            from nltk.corpus import stopwords
+            lemmatizer = WordNetLemmatizer()
+            STOP_WORDS = set(stopwords.words('english')) - {'not', 'but', 'however', 'no', 'yet'} # keep the ones important for sentiment analysis
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(word):
+    """Memoized token -> lemma lookup, bounded and kept across requests."""
+    return lemmatizer.lemmatize(word)
 
 def preprocess_comment(comment):
     """Apply preprocessing transformations to a comment."""
+    load_preprocessing()
     try:
-        # Convert to lowercase
-        comment = comment.lower()
-
-        # Remove trailing and leading whitespaces
-        comment = comment.strip()
+        # Convert to lowercase and remove trailing and leading whitespaces
+        comment = comment.lower().strip()
 
         # Remove newline characters
-        comment = re.sub(r'\n', ' ', comment)
+        comment = comment.replace('\n', ' ')
 
         # Remove non-alphanumeric characters, except punctuation
-        comment = re.sub(r'[^A-Za-z0-9\s!?.,]', '', comment)
-
-        # Remove stopwords but retain important ones for sentiment analysis
-        stop_words = set(stopwords.words('english')) - {'not', 'but', 'however', 'no', 'yet'}
-        comment = ' '.join([word for word in comment.split() if word not in stop_words])
+        comment = NON_ALPHANUMERIC_RE.sub('', comment)
 
-        # Lemmatize the words
-        lemmatizer = WordNetLemmatizer()
-        comment = ' '.join([lemmatizer.lemmatize(word) for word in comment.split()])
+        # Remove stopwords and lemmatize the remaining words
+        comment = ' '.join([lemmatize(word) for word in comment.split() if word not in STOP_WORDS])
 
         return comment
     except Exception as e:
         print(f"Error in preprocessing comment: {e}")
         return comment
 
-def load_vectorizer(vectorizer_path: str) -> TfidfVectorizer:
-    """Load the saved TF-IDF vectorizer."""
+def preprocess_batch(comments):
+    """Preprocess a list of comments, processing repeated comments only once."""
+    load_preprocessing()
+    processed = {}
+    results = []
+    for comment in comments:
+        try:
+            result = processed[comment]
+        except (KeyError, TypeError): # TypeError for unhashable (invalid) comments
+            result = preprocess_comment(comment)
+            if isinstance(comment, str):
+                processed[comment] = result
+        results.append(result)
+    return results
+
+def load_vectorizer(vectorizer_path: str):
+    """Load the saved TF-IDF vectorizer (a pickle, or an exported artifact directory for the memory-mapped fast path)."""
+    import joblib
     try:
+        if os.path.isdir(vectorizer_path):
+            return artifacts.load_vectorizer(vectorizer_path)
         with open(vectorizer_path, 'rb') as file:
             vectorizer = joblib.load(file)
         return vectorizer
@@ -54,6 +99,8 @@ def load_vectorizer(vectorizer_path: str) -> TfidfVectorizer:
         raise
 
 def load_model(model_name: str, model_version: str):
+    import mlflow # imported only when a model is loaded from MLflow
+    from mlflow.tracking import MlflowClient
     # Set MLflow tracking URI to your server
     mlflow.set_tracking_uri(satya_mlflow_ec2_uri)  # Replace with your MLflow tracking URI
     client = MlflowClient()
@@ -64,7 +111,10 @@ def load_model(model_name: str, model_version: str):
     return model
 
 def load_local_model(model_path: str):
+    """Load the saved model (a pickle, or an exported artifact directory holding the native LightGBM model)."""
     try:
+        if os.path.isdir(model_path):
+            return artifacts.load_model(model_path)
         with open(model_path, 'rb') as file:
             model = pickle.load(file)
         return model
@@ -72,185 +122,575 @@ def load_local_model(model_path: str):
         print(f'Error loading model from {model_path}: {e}')
         raise
 
-model = load_local_model("./models/lgbm_model.pkl")
-vectorizer = load_vectorizer("./models/tfidf_vectorizer.pkl")
+INFERENCE_SOCKET = os.getenv('SATYA_INFERENCE_SOCKET') # when set, predictions come from the shared inference process (utils/inference.py)
+inference_client = InferenceClient(INFERENCE_SOCKET) if INFERENCE_SOCKET else None
+model = vectorizer = None # loaded by load_models(); never loaded in the workers when the inference process is used
+
+def load_models():
+    """Loads the model and vectorizer once (on the first prediction or in warm_up)."""
+    global model, vectorizer
+    if model is not None:
+        return
+    with load_lock:
+        if model is None:
+            if artifacts.has_artifacts(): # exported by `python -m utils.artifacts export`
+                vectorizer = load_vectorizer(artifacts.ARTIFACT_DIR)
+                model = load_local_model(artifacts.ARTIFACT_DIR)
+            else:
+                vectorizer = load_vectorizer("./models/tfidf_vectorizer.pkl")
+                model = load_local_model("./models/lgbm_model.pkl")
+
+def warm_up():
+    """
+    Loads everything the first request would otherwise pay for: the stopwords, the WordNet corpus,
+    the model and vectorizer (or the inference connection), and runs one dummy prediction.
+    Called by gunicorn before a worker accepts traffic.
+    """
+    load_preprocessing()
+    lemmatizer.lemmatize('warming') # WordNet loads its corpus lazily on the first lemmatize
+    if inference_client is None:
+        load_models()
+    classify_comments([{'text': 'Warming up the sentiment model!', 'timestamp': '', 'authorId': ''}])
+
+comment_cache = comment_cache_from_env() # fetched comments by video_id, shared by all workers through its SQLite tier
+analysis_state = analysis_state_from_env() # newest publishedAt and comment-ID -> result map by video_id, for incremental runs
 
-def analyze_youtube_video(video_id):
+def predict_sentiment(transformed_comments):
     """
-    Fetches comments for a video_id, predicts sentiment, and returns formatted data.
+    Predicts sentiment classes and confidence scores for a sparse TF-IDF matrix.
+    The class is the argmax of predict_proba, so the model runs only once.
     """
-    comments_url = "https://www.googleapis.com/youtube/v3/commentThreads"
-    comments_data = []
-    page_token = ""
-    max_comments = 500
-    slice_limit = 100  # YouTube API max results per request
-    
-
-    # 1. Fetch Comments from YouTube (Max 500)
     try:
-        while len(comments_data) < max_comments:
-            params = {
-                'part': 'snippet',
-                'videoId': video_id,
-                'maxResults': slice_limit,
-                'key': YOUTUBE_API_KEY,
-                'pageToken': page_token,
-                'textFormat': 'plainText'
-            }
-            response = requests.get(comments_url, params=params)
-            data = response.json()
-            
-            # Check for API Errors (Like Comments Disabled)
-            if 'error' in data:
-                errors = data['error'].get('errors', [])
-                if errors:
-                    reason = errors[0].get('reason')
-                    if reason == 'commentsDisabled':
-                        return {"error": "Comments are disabled for this video."}
-                    if reason == 'videoNotFound':
-                        return {"error": "Video not found."}
-                    if reason == 'quotaExceeded':
-                        return {"error": "API Quota exceeded. Please try again later."}
-
-            for item in data['items']:
-                comment_snippet = item['snippet']['topLevelComment']['snippet']
-                comments_data.append({
-                    'text': comment_snippet['textOriginal'],
-                    'timestamp': comment_snippet['publishedAt'],
-                    'authorId': comment_snippet.get('authorChannelId', {}).get('value', 'Unknown')
-                })
-            
-            page_token = data.get('nextPageToken')
-            if not page_token:
-                break
-                
+        probs = model.predict_proba(transformed_comments)
+    except AttributeError: # model has no predict_proba (e.g. mlflow pyfunc), default confidence to 1.0
+        predictions = np.asarray(model.predict(transformed_comments))
+        return predictions, np.ones(len(predictions))
+    return model.classes_[probs.argmax(axis=1)], probs.max(axis=1)
+
+def classify_comments(comments_data):
+    """Preprocesses, vectorizes and predicts a batch of comments, returning the formatted records."""
+    if not comments_data:
+        return []
+
+    # Preprocess
+    with metrics.timer(STAGE_METRIC, stage='preprocess'):
+        preprocessed_comments = preprocess_batch([comment['text'] for comment in comments_data])
+
+    if inference_client is not None: # vectorize + predict in the shared inference process
+        with metrics.timer(STAGE_METRIC, stage='inference'):
+            predictions, confidence_scores = inference_client.predict(preprocessed_comments)
+    else:
+        load_models()
+
+        # Vectorize (kept as a sparse CSR matrix end to end)
+        with metrics.timer(STAGE_METRIC, stage='vectorize'):
+            transformed_comments = vectorizer.transform(preprocessed_comments)
+
+        # Predict class and confidence (probability) in one model pass
+        with metrics.timer(STAGE_METRIC, stage='predict'):
+            predictions, confidence_scores = predict_sentiment(transformed_comments)
+
+    with metrics.timer(STAGE_METRIC, stage='format'):
+        return format_results(comments_data, preprocessed_comments, predictions, confidence_scores)
+
+def format_results(comments_data, preprocessed_comments, predictions, confidence_scores):
+    """The response records of classified comments."""
+    formatted_response = []
+    for i, (comment_obj, pred, conf) in enumerate(zip(comments_data, predictions, confidence_scores)):
+        formatted_response.append({
+            "Original_Comment": comment_obj['text'], # sting
+            "Processed_Comment": preprocessed_comments[i], # sting
+            "confidence": round(float(conf), 2),
+            "sentiment": int(pred),
+            "timestamp": comment_obj['timestamp'], # sting
+            "AuthorID": comment_obj['authorId'] # sting
+        })
+    return formatted_response
+
+def save_analysis_state(video_id, comments_data, formatted_response):
+    """
+    Stores the newest publishedAt seen and the comment-ID -> result map of a video for incremental re-analysis.
+    A stored state with newer comments than comments_data (from an incremental run since they were fetched) is kept.
+    """
+    ids = [comment.get('id') for comment in comments_data]
+    if not formatted_response or None in ids: # comments cached before IDs were recorded
+        return
+    newest = max(comment['timestamp'] for comment in comments_data)
+    state = analysis_state.get(video_id)
+    if state is not None and state["newest"] > newest:
+        return
+    analysis_state.set(video_id, {"newest": newest, "results": dict(zip(ids, formatted_response))})
+
+def iter_analyzed_pages(video_id, incremental=False):
+    """
+    Yields the formatted results for a video_id one page at a time, as soon as each page is classified.
+    The fetch of the next page overlaps the ML work on the current one.
+    With incremental=True and a previous run stored, only the comments newer than that run are fetched and classified.
+    On failure a single {"error": ...} dict is yielded and the iteration stops.
+    """
+    if incremental:
+        state = analysis_state.get(video_id)
+        if state is not None:
+            yield from iter_new_comment_pages(video_id, state)
+            return
+
+    comments_data = comment_cache.get(video_id)
+    pages = [comments_data] if comments_data is not None else youtube.prefetch(youtube.iter_comment_pages(video_id))
+    fetched = []
+    formatted_response = []
+
+    try:
+        # 1. Fetch Comments from the cache or from YouTube (Max 500)
+        for page in pages:
+            fetched.extend(page)
+
+            # 2. ML Prediction Logic
+            try:
+                formatted_page = classify_comments(page)
+            except Exception as e:
+                print(f"Error in analysis: {e}")
+                yield {"error": f"Prediction failed: {str(e)}"}
+                return
+            formatted_response.extend(formatted_page)
+            yield formatted_page
+
+    except youtube.YouTubeAPIError as e:
+        yield {"error": str(e)}
+        return
     except Exception as e:
         print(f"Error fetching YouTube comments: {e}")
-        return {"error": str(e)}
+        yield {"error": str(e)}
+        return
 
-    if not comments_data:
-        return {"error": "No comments found for the provided video ID."}
+    if not fetched:
+        yield {"error": "No comments found for the provided video ID."}
+        return
+
+    if comments_data is None:
+        comment_cache.set(video_id, fetched)
+    save_analysis_state(video_id, fetched, formatted_response)
+
+def iter_new_comment_pages(video_id, state):
+    """
+    Incremental analysis: pages through commentThreads (newest first) only until it reaches a comment
+    already known from the previous run, classifies just the new comments and yields them,
+    then yields the stored results of the previous run (merged result capped at 500 comments).
+    """
+    known = state["results"]
+    new_comments = []
 
+    try:
+        for page in youtube.iter_comment_pages(video_id, order='time'): # no prefetch, so no page past the known comments is requested
+            reached_known = False
+            for comment in page:
+                if comment['id'] in known or comment['timestamp'] < state["newest"]:
+                    reached_known = True
+                    break
+                new_comments.append(comment)
+            if reached_known or len(new_comments) >= youtube.MAX_COMMENTS:
+                break
+    except youtube.YouTubeAPIError as e:
+        yield {"error": str(e)}
+        return
+    except Exception as e:
+        print(f"Error fetching YouTube comments: {e}")
+        yield {"error": str(e)}
+        return
 
-    # 2. ML Prediction Logic
+    new_comments = new_comments[:youtube.MAX_COMMENTS]
     try:
-        
-        # Preprocess
-        preprocessed_comments = [preprocess_comment(comment['text']) for comment in comments_data]
-        
-        # Vectorize
-        feature_names = vectorizer.get_feature_names_out()
-        transformed_comments = vectorizer.transform(preprocessed_comments)
-        transformed_comments = pd.DataFrame(transformed_comments.toarray(), columns=feature_names)
-
-        # Predict Class
-        predictions = model.predict(transformed_comments)
-        
-        # Predict Confidence (Probability) Note: If your model supports predict_proba, use it. Otherwise default to 1.0
-        try:
-            probs = model.predict_proba(transformed_comments) # why not .tolist() here
-            confidence_scores = np.max(probs, axis=1).tolist()
-        except AttributeError:
-            confidence_scores = [1.0] * len(predictions)
-
-
-        # 3. Format Response
-        formatted_response = []
-        for i, (comment_obj, pred, conf) in enumerate(zip(comments_data, predictions, confidence_scores)):
-            formatted_response.append({
-                "Original_Comment": comment_obj['text'], # sting
-                "Processed_Comment": preprocessed_comments[i], # sting
-                "confidence": round(float(conf), 2),
-                "sentiment": int(pred),
-                "timestamp": comment_obj['timestamp'], # sting
-                "AuthorID": comment_obj['authorId'] # sting
-            })
-            
-        return formatted_response
+        formatted_new = classify_comments(new_comments)
+    except Exception as e:
+        print(f"Error in analysis: {e}")
+        yield {"error": f"Prediction failed: {str(e)}"}
+        return
+
+    results = dict(zip([comment['id'] for comment in new_comments], formatted_new))
+    for comment_id, result in known.items():
+        if len(results) >= youtube.MAX_COMMENTS:
+            break
+        results.setdefault(comment_id, result)
+    previous = list(results.values())[len(formatted_new):]
+
+    if formatted_new:
+        yield formatted_new
+    if previous:
+        yield previous
+
+    if new_comments:
+        analysis_state.set(video_id, {"newest": max(state["newest"], *(comment['timestamp'] for comment in new_comments)), "results": results})
+        comment_cache.delete(video_id) # the cached comment list predates these comments; the next full run refetches
+
+def analyze_youtube_video(video_id, incremental=False):
+    """
+    Fetches comments for a video_id, predicts sentiment, and returns formatted data.
+    With incremental=True only comments newer than the previous run of the video are fetched and classified.
+    """
+    formatted_response = []
+    for page in iter_analyzed_pages(video_id, incremental=incremental):
+        if isinstance(page, dict): # error
+            return page
+        formatted_response.extend(page)
+    return formatted_response
+
+def sentiment_summary(formatted_response):
+    """Counts of each sentiment class, keyed like the extension's sentimentCounts ("1", "0", "-1")."""
+    counts = {"1": 0, "0": 0, "-1": 0}
+    for comment in formatted_response:
+        counts[str(comment["sentiment"])] += 1
+    return {"total": len(formatted_response), "sentiment_counts": counts}
+
+def fetch_comments_cached(video_id):
+    """Comments of a video from the comment cache, or fetched from YouTube and cached. May return an {"error": ...} dict."""
+    comments_data = comment_cache.get(video_id)
+    if comments_data is None:
+        comments_data = youtube.fetch_youtube_comments(video_id)
+        if isinstance(comments_data, list) and comments_data:
+            comment_cache.set(video_id, comments_data)
+    return comments_data
+
+def analyze_youtube_videos(video_ids):
+    """
+    Analyzes several videos at once: comments are fetched concurrently (at most BATCH_FETCH_CONCURRENCY videos at a time)
+    and classified in one combined vectorize + predict pass.
+    Returns {"results": {video_id: [...] or {"error": ...}}, "summaries": {video_id: summary}}.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_FETCH_CONCURRENCY, len(video_ids)))) as pool:
+        fetched = dict(zip(video_ids, pool.map(fetch_comments_cached, video_ids)))
+
+    results = {}
+    batch = []
+    for video_id, comments_data in fetched.items():
+        if isinstance(comments_data, dict): # API error
+            results[video_id] = comments_data
+        elif not comments_data:
+            results[video_id] = {"error": "No comments found for the provided video ID."}
+        else:
+            batch.extend(comments_data)
 
+    try:
+        formatted_batch = classify_comments(batch)
     except Exception as e:
         print(f"Error in analysis: {e}")
         return {"error": f"Prediction failed: {str(e)}"}
 
+    offset = 0
+    for video_id, comments_data in fetched.items():
+        if video_id in results:
+            continue
+        results[video_id] = formatted_batch[offset:offset + len(comments_data)]
+        offset += len(comments_data)
+        save_analysis_state(video_id, comments_data, results[video_id])
+
+    return {
+        "results": {video_id: results[video_id] for video_id in video_ids},
+        "summaries": {video_id: sentiment_summary(results[video_id]) for video_id in video_ids if isinstance(results[video_id], list)}
+    }
+
+# Chart styling, built once and shared by every render. Each render draws on its own Figure with an Agg canvas
+# (no pyplot), so renders on different threads share no matplotlib state.
+PIE_STYLE = {
+    "labels": ['Positive', 'Neutral', 'Negative'],
+    "colors": ['#36A2EB', '#C9CBCF', '#FF6384'], # Blue, Gray, Red
+    "autopct": '%1.1f%%',
+    "startangle": 140,
+    "textprops": {'color': 'w'}
+}
+TREND_LINES = [ # sentiment value, label, color
+    (-1, 'Negative', 'red'),
+    (0, 'Neutral', 'gray'),
+    (1, 'Positive', 'green')
+]
+WORDCLOUD_STYLE = {
+    "background_color": 'black',
+    "colormap": 'Blues',
+    "collocations": False,
+    "random_state": 0 # same words, same layout, so a cached PNG matches a fresh render
+}
+WORDCLOUD_SIZES = {'full': (800, 400), 'thumbnail': (320, 160)} # width, height
+WORDCLOUD_FORMATS = { # Pillow format, mimetype, save options
+    'png': ('PNG', 'image/png', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4})
+}
+WORD_RE = re.compile(r"\w[\w']*") # WordCloud's default tokenizer
+
+@lru_cache(maxsize=None)
+def wordcloud_stopwords():
+    from nltk.corpus import stopwords as nltk_stopwords
+    return frozenset(nltk_stopwords.words('english'))
+
+def new_figure(figsize):
+    fig = mfigure.Figure(figsize=figsize)
+    magg.FigureCanvasAgg(fig)
+    return fig
+
+@metrics.timer('satya_render_duration_seconds', chart='pie')
+def render_chart(sentiment_counts):
+    """Pie chart of the sentiment counts ({"1": n, "0": n, "-1": n}) as PNG bytes."""
+    sizes = [
+        int(sentiment_counts.get('1', 0)),
+        int(sentiment_counts.get('0', 0)),
+        int(sentiment_counts.get('-1', 0))
+    ]
+    if sum(sizes) == 0:
+        raise ValueError("Sentiment counts sum to zero")
+
+    fig = new_figure((6, 6))
+    ax = fig.subplots()
+    ax.pie(sizes, **PIE_STYLE)
+    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+
+    img_io = io.BytesIO()
+    fig.savefig(img_io, format='PNG', transparent=True)
+    return img_io.getvalue()
+
+def term_frequencies(preprocessed_comments):
+    """
+    Word counts of preprocessed (lowercase) comments, filtered like WordCloud.process_text without collocations:
+    numbers and stopwords are dropped and plurals are folded into their singular when both appear.
+    """
+    stopwords = wordcloud_stopwords()
+    counts = Counter(WORD_RE.findall(' '.join(preprocessed_comments)))
+    for word in list(counts):
+        if word.isdigit() or word in stopwords:
+            del counts[word]
+    for word in list(counts):
+        if word.endswith('s') and not word.endswith('ss') and word[:-1] in counts:
+            counts[word[:-1]] += counts.pop(word)
+    return counts
+
+@metrics.timer('satya_render_duration_seconds', chart='wordcloud')
+def render_wordcloud(preprocessed_comments, size='full', image_format='png'):
+    """Word cloud of already preprocessed comments as image bytes, in one of WORDCLOUD_SIZES and WORDCLOUD_FORMATS."""
+    from wordcloud import WordCloud
+    width, height = WORDCLOUD_SIZES[size]
+    pillow_format, _, options = WORDCLOUD_FORMATS[image_format]
+    wordcloud = WordCloud(width=width, height=height, **WORDCLOUD_STYLE).generate_from_frequencies(term_frequencies(preprocessed_comments))
+
+    img_io = io.BytesIO()
+    wordcloud.to_image().save(img_io, format=pillow_format, **options)
+    return img_io.getvalue()
+
+TREND_GRANULARITIES = {'day': ('Daily', 'Day', '%Y-%m-%d'), 'week': ('Weekly', 'Week', '%Y-%m-%d'), 'month': ('Monthly', 'Month', '%Y-%m')} # title, axis label, tick format
+
+def sentiment_trend(sentiment_data, granularity='month'):
+    """
+    Bins [{"timestamp": ..., "sentiment": ...}, ...] by day, week (starting Monday) or month with NumPy.
+    Returns {"granularity", "bins": [ISO start date of each bin], "totals": [...], "counts": {"1": [...], "0": [...], "-1": [...]},
+    "percentages": {...}}. Bins without comments are left out. Raises ValueError on bad input.
+    """
+    if granularity not in TREND_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(TREND_GRANULARITIES)}")
+    if not sentiment_data:
+        raise ValueError("No sentiment data provided")
+    timestamps = np.array([item['timestamp'].rstrip('Z') for item in sentiment_data], dtype='datetime64[s]') # YouTube publishedAt is UTC
+    sentiments = np.fromiter((item['sentiment'] for item in sentiment_data), dtype=np.int64, count=len(sentiment_data))
+    if ((sentiments < -1) | (sentiments > 1)).any():
+        raise ValueError("Sentiment values must be -1, 0 or 1")
+
+    if granularity == 'month':
+        units = timestamps.astype('datetime64[M]').astype(np.int64)
+    else:
+        days = timestamps.astype('datetime64[D]').astype(np.int64)
+        units = days if granularity == 'day' else (days + 3) // 7 # weeks starting Monday (1970-01-01 was a Thursday)
+
+    # one bincount over (bin, sentiment) pairs instead of a resample + value_counts + unstack
+    starts, bins = np.unique(units, return_inverse=True)
+    counts = np.bincount(bins * 3 + sentiments + 1, minlength=len(starts) * 3).reshape(-1, 3) # columns: -1, 0, 1
+    totals = counts.sum(axis=1)
+    percentages = np.round(counts * 100 / totals[:, None], 2)
+
+    if granularity == 'month':
+        dates = starts.astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        dates = (starts if granularity == 'day' else starts * 7 - 3).astype('datetime64[D]')
+    return {
+        "granularity": granularity,
+        "bins": dates.astype(str).tolist(),
+        "totals": totals.tolist(),
+        "counts": {str(value): counts[:, value + 1].tolist() for value in (1, 0, -1)},
+        "percentages": {str(value): percentages[:, value + 1].tolist() for value in (1, 0, -1)},
+    }
+
+@metrics.timer('satya_render_duration_seconds', chart='trend_graph')
+def render_trend_graph(sentiment_data, granularity='month'):
+    """Sentiment percentages per day, week or month of [{"timestamp": ..., "sentiment": ...}, ...] as PNG bytes."""
+    trend = sentiment_trend(sentiment_data, granularity)
+    title, axis_label, date_format = TREND_GRANULARITIES[granularity]
+    dates = np.array(trend["bins"], dtype='datetime64[D]')
+
+    # Plotting
+    fig = new_figure((12, 6))
+    ax = fig.subplots()
+    for sentiment_value, label, color in TREND_LINES:
+        ax.plot(dates, trend["percentages"][str(sentiment_value)], marker='o', linestyle='-', label=label, color=color)
+
+    ax.set_title(f'{title} Sentiment Percentage Over Time')
+    ax.set_xlabel(axis_label)
+    ax.set_ylabel('Percentage of Comments (%)')
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+
+    # Format the x-axis dates
+    ax.xaxis.set_major_formatter(mdates.DateFormatter(date_format))
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=12))
+
+    ax.legend()
+    fig.tight_layout()
+
+    img_io = io.BytesIO()
+    fig.savefig(img_io, format='PNG')
+    return img_io.getvalue()
+
+RENDER_VERSION = 2 # bump when a renderer's output changes, so cached PNGs and their ETags are invalidated
+render_cache = render_cache_from_env() # rendered PNGs by content hash, shared by all workers through its SQLite tier
+render_counters = {"not_modified": 0, "bytes_saved": 0} # 304 responses, and PNG bytes served without rendering or resending
+render_counters_lock = threading.Lock() # updated by concurrent request threads (gunicorn threads, the render pool callers)
+
+def normalize_sentiment_counts(sentiment_counts):
+    return {key: int(sentiment_counts.get(key, 0)) for key in ('1', '0', '-1')}
+
+def normalize_sentiment_data(sentiment_data):
+    # order does not change the monthly percentages
+    return sorted(({"timestamp": item['timestamp'], "sentiment": int(item['sentiment'])} for item in sentiment_data),
+                  key=lambda item: (item['timestamp'], item['sentiment']))
+
+def render_key(kind, payload):
+    """Content address of a render: a hash of the chart kind, the render version and the normalized payload."""
+    blob = json.dumps([kind, RENDER_VERSION, payload], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def cached_png(key):
+    """A previously rendered PNG from render_cache, or None."""
+    png = render_cache.get(key)
+    if png is not None:
+        with render_counters_lock:
+            render_counters["bytes_saved"] += len(png)
+    return png
+
+def cached_render(key, render, payload):
+    """PNG bytes of render(payload): from render_cache when the same payload was rendered before, else rendered on render_pool."""
+    png = cached_png(key)
+    if png is None:
+        png = render_pool.run(render, payload)
+        render_cache.set(key, png)
+    return png
+
+def not_modified(key, if_none_match, parts=None):
+    """
+    True when the client's If-None-Match already names this render, or the bundle of the renders keyed by parts.
+    Counts the PNG bytes not resent from their stored sizes, without a render_cache lookup (which would count as a hit or miss).
+    """
+    if not if_none_match.contains(key):
+        return False
+    saved = sum(render_cache.size(part) or 0 for part in (parts or [key]))
+    with render_counters_lock:
+        render_counters["not_modified"] += 1
+        render_counters["bytes_saved"] += saved
+    return True
+
+def image_response(request, kind, render, payload, mimetype='image/png'):
+    """Image response for a render with a strong ETag, or 304 Not Modified if the client already has it."""
+    key = render_key(kind, payload)
+    if not_modified(key, request.if_none_match):
+        response = Response(status=304)
+    else:
+        response = send_file(io.BytesIO(cached_render(key, render, payload)), mimetype=mimetype)
+    response.set_etag(key)
+    return response
+
+def render_stats():
+    """Render counters for /api/cache_stats: cache hits, misses, hit rate, 304s, bytes saved and renders rejected by a full queue."""
+    stats = render_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    with render_counters_lock:
+        counters = dict(render_counters)
+    return {**stats, **counters, "rejected": render_pool.rejected, "hit_rate": round(stats["hits"] / lookups, 3) if lookups else None}
+
+def stored_analysis(video_id):
+    """The formatted results of a video's last analysis (held in analysis_state), or None if it has not been analyzed."""
+    state = analysis_state.get(video_id)
+    if not state or not state["results"]:
+        return None
+    return list(state["results"].values())
+
+def render_chart_bundle(video_id, if_none_match):
+    """
+    Renders the pie chart, word cloud and trend graph of a video's last analysis (held in analysis_state) in parallel on render_pool.
+    Returns {"etag": ..., "charts": {name: base64 PNG or None}, "errors": {name: message}}, {"etag": ..., "not_modified": True}
+    when the client's If-None-Match names this bundle, or None if the video has not been analyzed.
+    The etag is None when a chart failed, so a partial bundle is never revalidated.
+    """
+    analyzed = stored_analysis(video_id)
+    if analyzed is None:
+        return None
+
+    renders = {
+        "chart": ('chart', render_chart, normalize_sentiment_counts(sentiment_summary(analyzed)["sentiment_counts"])),
+        "wordcloud": ('wordcloud', render_wordcloud, sorted(comment["Processed_Comment"] for comment in analyzed)), # already preprocessed by the analysis
+        "trend_graph": ('trend_graph:month', render_trend_graph, normalize_sentiment_data(analyzed)),
+    }
+    keys = {name: render_key(kind, payload) for name, (kind, _, payload) in renders.items()}
+    etag = hashlib.sha256(''.join(keys.values()).encode()).hexdigest()
+    if not_modified(etag, if_none_match, parts=keys.values()):
+        return {"etag": etag, "not_modified": True}
+
+    pngs, futures, errors = {}, {}, {}
+    for name, (_, render, payload) in renders.items():
+        pngs[name] = cached_png(keys[name])
+        if pngs[name] is None:
+            try:
+                futures[name] = render_pool.submit(render, payload)
+            except RenderQueueFull as e:
+                errors[name] = str(e)
+    for name, future in futures.items():
+        try:
+            pngs[name] = future.result()
+            render_cache.set(keys[name], pngs[name])
+        except Exception as e:
+            current_app.logger.error(f"Error rendering {name} for {video_id}: {e}")
+            errors[name] = str(e)
+
+    charts = {name: base64.b64encode(png).decode('ascii') if png is not None else None for name, png in pngs.items()}
+    return {"etag": None if errors else etag, "charts": charts, "errors": errors}
+
 def generate_chart(request):
 
     try:
         data = request.get_json()
         sentiment_counts = data.get('sentiment_counts')
-        
+
         if not sentiment_counts:
             return jsonify({"error": "No sentiment counts provided"}), 400
 
-        # Prepare data for the pie chart
-        labels = ['Positive', 'Neutral', 'Negative']
-        sizes = [
-            int(sentiment_counts.get('1', 0)),
-            int(sentiment_counts.get('0', 0)),
-            int(sentiment_counts.get('-1', 0))
-        ]
-        if sum(sizes) == 0:
-            raise ValueError("Sentiment counts sum to zero")
-        
-        colors = ['#36A2EB', '#C9CBCF', '#FF6384']  # Blue, Gray, Red
-
-        # Generate the pie chart
-        plt.figure(figsize=(6, 6))
-        plt.pie(
-            sizes,
-            labels=labels,
-            colors=colors,
-            autopct='%1.1f%%',
-            startangle=140,
-            textprops={'color': 'w'}
-        )
-        plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-
-        # Save the chart to a BytesIO object
-        img_io = io.BytesIO()
-        plt.savefig(img_io, format='PNG', transparent=True)
-        img_io.seek(0)
-        plt.close()
-
         # Return the image as a response
-        return send_file(img_io, mimetype='image/png')
+        return image_response(request, 'chart', render_chart, normalize_sentiment_counts(sentiment_counts))
+    except RenderQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
-        app.logger.error(f"Error in /generate_chart: {e}")
+        current_app.logger.error(f"Error in /generate_chart: {e}")
         return jsonify({"error": f"Chart generation failed: {str(e)}"}), 500
 
 def generate_wordcloud(request):
-    
+
     try:
         data = request.get_json()
         comments = data.get('comments')
+        size = data.get('size', 'full')
+        image_format = data.get('format', 'png')
 
         if not comments:
             return jsonify({"error": "No comments provided"}), 400
-
-        # Preprocess comments
-        preprocessed_comments = [preprocess_comment(comment) for comment in comments]
-
-        # Combine all comments into a single string
-        text = ' '.join(preprocessed_comments)
-
-        # Generate the word cloud
-        wordcloud = WordCloud(
-            width=800,
-            height=400,
-            background_color='black',
-            colormap='Blues',
-            stopwords=set(stopwords.words('english')),
-            collocations=False
-        ).generate(text)
-
-        # Save the word cloud to a BytesIO object
-        img_io = io.BytesIO()
-        wordcloud.to_image().save(img_io, format='PNG')
-        img_io.seek(0)
-
-        # Return the image as a response
-        return send_file(img_io, mimetype='image/png')
+        if size not in WORDCLOUD_SIZES or image_format not in WORDCLOUD_FORMATS:
+            return jsonify({"error": f"size must be one of {', '.join(WORDCLOUD_SIZES)} and format one of {', '.join(WORDCLOUD_FORMATS)}"}), 400
+
+        # Return the image as a response (word frequencies do not depend on the comment order)
+        render = lambda comments: render_wordcloud(preprocess_batch(comments), size, image_format)
+        return image_response(request, f'wordcloud_comments:{size}:{image_format}', render, sorted(comments), mimetype=WORDCLOUD_FORMATS[image_format][1])
+    except RenderQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
-        app.logger.error(f"Error in /generate_wordcloud: {e}")
+        current_app.logger.error(f"Error in /generate_wordcloud: {e}")
         return jsonify({"error": f"Word cloud generation failed: {str(e)}"}), 500
 
 def generate_trend_graph(request):
@@ -258,80 +698,43 @@ def generate_trend_graph(request):
     try:
         data = request.get_json()
         sentiment_data = data.get('sentiment_data')
+        granularity = data.get('granularity', 'month')
 
         if not sentiment_data:
             return jsonify({"error": "No sentiment data provided"}), 400
+        if granularity not in TREND_GRANULARITIES:
+            return jsonify({"error": f"granularity must be one of {', '.join(TREND_GRANULARITIES)}"}), 400
 
-        # Convert sentiment_data to DataFrame
-        df = pd.DataFrame(sentiment_data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-        # Set the timestamp as the index
-        df.set_index('timestamp', inplace=True)
-
-        # Ensure the 'sentiment' column is numeric
-        df['sentiment'] = df['sentiment'].astype(int)
-
-        # Map sentiment values to labels
-        sentiment_labels = {-1: 'Negative', 0: 'Neutral', 1: 'Positive'}
-
-        # Resample the data over monthly intervals and count sentiments
-        monthly_counts = df.resample('ME')['sentiment'].value_counts().unstack(fill_value=0)
-
-        # Calculate total counts per month
-        monthly_totals = monthly_counts.sum(axis=1)
-
-        # Calculate percentages
-        monthly_percentages = (monthly_counts.T / monthly_totals).T * 100
-
-        # Ensure all sentiment columns are present
-        for sentiment_value in [-1, 0, 1]:
-            if sentiment_value not in monthly_percentages.columns:
-                monthly_percentages[sentiment_value] = 0
-
-        # Sort columns by sentiment value
-        monthly_percentages = monthly_percentages[[-1, 0, 1]]
-
-        # Plotting
-        plt.figure(figsize=(12, 6))
-
-        colors = {
-            -1: 'red',     # Negative sentiment
-            0: 'gray',     # Neutral sentiment
-            1: 'green'     # Positive sentiment
-        }
-
-        for sentiment_value in [-1, 0, 1]:
-            plt.plot(
-                monthly_percentages.index,
-                monthly_percentages[sentiment_value],
-                marker='o',
-                linestyle='-',
-                label=sentiment_labels[sentiment_value],
-                color=colors[sentiment_value]
-            )
-
-        plt.title('Monthly Sentiment Percentage Over Time')
-        plt.xlabel('Month')
-        plt.ylabel('Percentage of Comments (%)')
-        plt.grid(True)
-        plt.xticks(rotation=45)
-
-        # Format the x-axis dates
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=12))
-
-        plt.legend()
-        plt.tight_layout()
+        # Return the image as a response
+        return image_response(request, f'trend_graph:{granularity}', lambda data: render_trend_graph(data, granularity), normalize_sentiment_data(sentiment_data))
+    except RenderQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except Exception as e:
+        current_app.logger.error(f"Error in /generate_trend_graph: {e}")
+        return jsonify({"error": f"Trend graph generation failed: {str(e)}"}), 500
 
-        # Save the trend graph to a BytesIO object
-        img_io = io.BytesIO()
-        plt.savefig(img_io, format='PNG')
-        img_io.seek(0)
-        plt.close()
+def get_sentiment_trend(request):
+    """
+    The binned sentiment series as JSON, for {"videoId": ...} (the server-held analysis) or {"sentiment_data": [...]},
+    with an optional "granularity" of day, week or month (default).
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        granularity = data.get('granularity', 'month')
+        if granularity not in TREND_GRANULARITIES:
+            return jsonify({"error": f"granularity must be one of {', '.join(TREND_GRANULARITIES)}"}), 400
+        if data.get('videoId'):
+            sentiment_data = stored_analysis(data['videoId'])
+            if sentiment_data is None:
+                return jsonify({"error": "No analysis found for this video. Analyze it first."}), 404
+        else:
+            sentiment_data = data.get('sentiment_data')
+        if not sentiment_data:
+            return jsonify({"error": "No Video ID or sentiment data provided"}), 400
 
-        # Return the image as a response
-        return send_file(img_io, mimetype='image/png')
+        return jsonify(sentiment_trend(sentiment_data, granularity))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid sentiment data: {str(e)}"}), 400
     except Exception as e:
-        app.logger.error(f"Error in /generate_trend_graph: {e}")
-        return jsonify({"error": f"Trend graph generation failed: {str(e)}"}), 500
\ No newline at end of file
+        current_app.logger.error(f"Error in /sentiment_trend: {e}")
+        return jsonify({"error": f"Trend aggregation failed: {str(e)}"}), 500
@@ -0,0 +1,136 @@
+# Server-side Flask sessions in a local SQLite (WAL) file shared by every gunicorn worker, with an in-process LRU
+# of recently used sessions in front of it. Replaces Flask-Session's filesystem backend (one file per session,
+# swept by globbing and stat-ing the whole directory).
+# - Rows carry expires_at with an index on it, so expired sessions are found without scanning the live ones.
+#   A background thread per process deletes them SESSION_SWEEP_BATCH rows at a time every SESSION_SWEEP_INTERVAL seconds.
+# - The memory tier holds encoded sessions for SESSION_MEMORY_TTL seconds. A hit is only used while SQLite's
+#   data_version shows no commit from another connection (another worker or thread) since this thread last
+#   looked; otherwise the memory tier is dropped, so a logout in one worker is never hidden by another's copy.
+# Enabled by SESSION_TYPE=sqlite (the default in app.py); any other SESSION_TYPE goes to Flask-Session.
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+from utils.cache import LRUCache
+import threading, sqlite3, time, os
+
+SESSION_PATH = os.getenv('SESSION_SQLITE_PATH', './cache/sessions.db')
+MEMORY_SIZE = int(os.getenv('SESSION_MEMORY_SIZE', 4096))
+MEMORY_TTL = float(os.getenv('SESSION_MEMORY_TTL', 60))
+SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+SWEEP_BATCH = int(os.getenv('SESSION_SWEEP_BATCH', 1000))
+
+
+class SQLiteSession(ServerSideSession):
+    pass
+
+
+class SQLiteSessionInterface(ServerSideSessionInterface):
+    """Flask-Session interface storing msgpack-encoded sessions in SQLite, keyed by the prefixed session id."""
+
+    session_class = SQLiteSession
+    ttl = True # expiry is handled by the sweeper below, not by Flask-Session's per-request cleanup
+
+    def __init__(self, app, path=SESSION_PATH, memory_size=MEMORY_SIZE, memory_ttl=MEMORY_TTL, sweep_interval=SWEEP_INTERVAL, sweep_batch=SWEEP_BATCH,
+                 key_prefix='session:', permanent=True, sid_length=32, serialization_format='msgpack'):
+        super().__init__(app, key_prefix, False, permanent, sid_length, serialization_format)
+        self.path = path
+        self.memory = LRUCache(max_entries=memory_size, ttl=memory_ttl) # store_id -> (encoded session, expires_at)
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.swept = 0
+        self.writes = 0 # sessions saved by this process
+        self._local = threading.local()
+        self._sweeper = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _reset(self): # a forked worker starts its own sweeper and connections
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.memory.clear()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): # one connection per thread, reopened after a fork
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid, self._local.data_version = conn, os.getpid(), None
+        return conn
+
+    def _memory_is_current(self, conn):
+        """False (and the memory tier cleared) if another connection committed since this thread's last check."""
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._local.data_version:
+            return True
+        self._local.data_version = version
+        self.memory.clear()
+        return False
+
+    def _retrieve_session_data(self, store_id):
+        self._ensure_sweeper()
+        conn = self._connect()
+        now = time.time()
+        entry = self.memory.get(store_id) if self._memory_is_current(conn) else None
+        if entry is None:
+            entry = conn.execute("SELECT data, expires_at FROM sessions WHERE id = ?", (store_id,)).fetchone()
+            if entry is None:
+                return None
+            self.memory.set(store_id, entry, ttl=min(self.memory.ttl, entry[1] - now))
+        if entry[1] < now: # expired, not swept yet
+            return None
+        return self.serializer.decode(entry[0])
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        data = self.serializer.encode(session)
+        expires_at = time.time() + session_lifetime.total_seconds()
+        self._connect().execute("INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)", (store_id, data, expires_at))
+        self.memory.set(store_id, (data, expires_at))
+        self.writes += 1
+
+    def _delete_session(self, store_id):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (store_id,))
+        self.memory.delete(store_id)
+
+    def _delete_expired_sessions(self):
+        """Deletes every expired session, one batch per transaction so requests can write in between; returns the count."""
+        conn = self._connect()
+        deleted = 0
+        while True:
+            cursor = conn.execute("DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires_at < ? ORDER BY expires_at LIMIT ?)",
+                                  (time.time(), self.sweep_batch))
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.sweep_batch:
+                break
+        self.swept += deleted
+        return deleted
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, daemon=True)
+        self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self._delete_expired_sessions()
+            except sqlite3.Error as e:
+                print(f"Error sweeping sessions: {e}")
+
+    def stats(self):
+        live = self._connect().execute("SELECT COUNT(*) FROM sessions WHERE expires_at >= ?", (time.time(),)).fetchone()[0]
+        return {"live": live, "writes": self.writes, "swept": self.swept, "memory": self.memory.stats()}
+
+
+def init_app(app):
+    """Installs the SQLite session interface on app, configured by the SESSION_* environment variables above."""
+    app.session_interface = SQLiteSessionInterface(app, permanent=app.config.get('SESSION_PERMANENT', True))
+    return app.session_interface
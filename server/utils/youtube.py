@@ -0,0 +1,149 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from utils import metrics
+import threading, queue, requests, os
+load_dotenv()
+
+YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
+YOUTUBE_API_BASE_URL = os.getenv('YOUTUBE_API_BASE_URL', 'https://www.googleapis.com/youtube/v3') # point at a local stand-in for load testing
+YOUTUBE_API_TIMEOUT = (float(os.getenv('YOUTUBE_API_CONNECT_TIMEOUT', 3.05)), float(os.getenv('YOUTUBE_API_READ_TIMEOUT', 10)))
+MAX_COMMENTS = 500
+SLICE_LIMIT = 100  # YouTube API max results per request
+
+ERROR_MESSAGES = {
+    'commentsDisabled': "Comments are disabled for this video.",
+    'videoNotFound': "Video not found.",
+    'quotaExceeded': "API Quota exceeded. Please try again later.",
+    'backendError': "YouTube is temporarily unavailable. Please try again later.",
+}
+
+class YouTubeAPIError(Exception):
+    """Raised when the YouTube API reports an error (comments disabled, video not found, quota exceeded)."""
+
+def create_session(pool_size=10, retries=3):
+    """
+    Keep-alive session shared by all requests, so pages reuse pooled TLS connections.
+    Retries 429 and 5xx responses with exponential backoff (honouring Retry-After).
+    """
+    retry = Retry(total=retries,
+                  backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']),
+                  raise_on_status=False) # hand the last response back so its API error is reported
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(record_response)
+    return session
+
+def record_response(response, *args, **kwargs):
+    """Response hook: observes the time to the response headers (the final attempt after any retries)."""
+    metrics.observe('outbound_request_duration_seconds', response.elapsed.total_seconds(),
+                    service=urlparse(response.url).hostname, outcome=str(response.status_code))
+
+session = create_session()
+
+def iter_comment_pages(video_id, max_comments=MAX_COMMENTS, order=None):
+    """
+    Yields the top-level comments of a video one commentThreads page at a time, up to max_comments.
+    order='time' pages newest first (the incremental walk needs that); the default keeps YouTube's own
+    relevance ranking, which decides which comments a normal analysis sees.
+    Each comment is a dict with id, text, timestamp and authorId. Raises YouTubeAPIError on API errors.
+    """
+    fetched = 0
+    page_token = ""
+    while fetched < max_comments:
+        params = {
+            'part': 'snippet',
+            'videoId': video_id,
+            'maxResults': SLICE_LIMIT,
+            'key': YOUTUBE_API_KEY,
+            'pageToken': page_token,
+            'textFormat': 'plainText'
+        }
+        if order:
+            params['order'] = order
+        with metrics.timer('satya_stage_duration_seconds', stage='fetch_page'):
+            response = session.get(f"{YOUTUBE_API_BASE_URL}/commentThreads", params=params, timeout=YOUTUBE_API_TIMEOUT)
+            try:
+                data = response.json()
+            except ValueError: # e.g. an HTML error page from a proxy after the retries ran out
+                raise YouTubeAPIError(f"YouTube API returned HTTP {response.status_code}.")
+
+        # Check for API Errors (Like Comments Disabled)
+        if 'error' in data:
+            errors = data['error'].get('errors', [])
+            reason = errors[0].get('reason') if errors else None
+            raise YouTubeAPIError(ERROR_MESSAGES.get(reason) or data['error'].get('message') or "YouTube API error.")
+
+        page = []
+        for item in data['items']:
+            comment_snippet = item['snippet']['topLevelComment']['snippet']
+            page.append({
+                'id': item['id'],
+                'text': comment_snippet['textOriginal'],
+                'timestamp': comment_snippet['publishedAt'],
+                'authorId': comment_snippet.get('authorChannelId', {}).get('value', 'Unknown')
+            })
+        fetched += len(page)
+        yield page
+
+        page_token = data.get('nextPageToken')
+        if not page_token:
+            break
+
+def prefetch(pages, depth=2):
+    """
+    Runs the pages iterator in a background thread and yields its items as they arrive,
+    so the caller's CPU work on one page overlaps the network wait for the next.
+    Exceptions raised by the iterator are re-raised in the caller.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set() # lets the producer exit if the caller stops early
+
+def fetch_youtube_comments(video_id):
+    """
+    Fetches up to 500 top-level comments for a video_id from the YouTube API.
+    Returns a list of comment dicts, or a dict with an "error" key.
+    """
+    try:
+        return [comment for page in iter_comment_pages(video_id) for comment in page]
+    except YouTubeAPIError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        print(f"Error fetching YouTube comments: {e}")
+        return {"error": str(e)}